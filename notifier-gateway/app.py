@@ -1,8 +1,16 @@
 import os
+import re
 import time
 import json
+import fcntl
+import atexit
+import secrets
+import sqlite3
+import tempfile
 import threading
-from typing import Dict, Any, List
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, List, Optional, Tuple
 
 import requests
 from flask import Flask, request, jsonify
@@ -25,6 +33,25 @@ INBOX_TOKEN = os.getenv("INBOX_TOKEN", "")
 # comma-separated allowlist of E.164 numbers (+1xxx), or "*" to allow all
 ALLOW_SENDERS = {s.strip() for s in os.getenv("ALLOW_SENDERS", "*").split(",") if s.strip()}
 
+# warm-restart snapshot (poller/backoff/dedup); mount DATA_DIR as a volume to survive redeploys
+DATA_DIR = os.getenv("DATA_DIR", "/data")
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(DATA_DIR, "gateway-state.json"))
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "30"))  # seconds
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "3600"))  # seconds an envelope (source, timestamp) is remembered
+
+# tracing: spans as JSON lines, shared by all workers; /debug/traces reads the tail
+TRACE_PATH = os.getenv("TRACE_PATH", os.path.join(DATA_DIR, "traces.jsonl"))
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(20_000_000)))  # rotated to .1 beyond this
+SERVICE_NAME = os.getenv("SERVICE_NAME", "notifier-gateway")
+
+# group/contact directory from signal-api, kept in memory and refreshed in the background
+DIRECTORY_TTL = int(os.getenv("DIRECTORY_TTL", "300"))  # seconds between refreshes; 0 = off
+DIRECTORY_MIN_REFRESH = int(os.getenv("DIRECTORY_MIN_REFRESH", "10"))  # seconds; floor for refreshes on a miss
+
+# /send replays the stored response for a repeated Idempotency-Key instead of sending twice
+IDEMPOTENCY_TTL = int(os.getenv("IDEMPOTENCY_TTL", "86400"))  # seconds a key is remembered; 0 = off
+IDEMPOTENCY_DB = os.getenv("IDEMPOTENCY_DB", os.path.join(DATA_DIR, "idempotency.db"))  # shared by all workers
+
 # -------------------------
 # Poller control (no Flask hooks)
 # -------------------------
@@ -32,6 +59,377 @@ _poller_thread: threading.Thread | None = None
 _stop_event = threading.Event()
 _started_flag = threading.Event()  # avoid double-start within a worker
 
+# -------------------------
+# Warm-restart state
+# -------------------------
+_state_lock = threading.Lock()
+_backoff = 1                   # current poller backoff (seconds)
+_seen: Dict[str, float] = {}   # "source:timestamp" -> first seen (epoch), pruned after DEDUP_WINDOW
+_snapshot_lock_fd = None       # flock held by the one worker that owns the snapshot
+
+def _claim_snapshot() -> bool:
+    """
+    gunicorn runs several workers; only the one holding the lock file reads/writes
+    the snapshot, so workers don't overwrite each other or resume the poller twice.
+    """
+    global _snapshot_lock_fd
+    if _snapshot_lock_fd is not None:
+        return True
+    try:
+        os.makedirs(os.path.dirname(SNAPSHOT_PATH) or ".", exist_ok=True)
+        fd = os.open(SNAPSHOT_PATH + ".lock", os.O_CREAT | os.O_RDWR, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        _snapshot_lock_fd = fd
+        return True
+    except OSError as e:
+        app.logger.warning("Snapshot disabled (%s): %s", SNAPSHOT_PATH, e)
+        return False
+
+def _seen_before(key: str) -> bool:
+    now = time.time()
+    with _state_lock:
+        if key in _seen and now - _seen[key] < DEDUP_WINDOW:
+            return True
+        _seen[key] = now
+        return False
+
+def _save_snapshot() -> None:
+    if _snapshot_lock_fd is None:
+        return
+    cutoff = time.time() - DEDUP_WINDOW
+    with _state_lock:
+        for k in [k for k, ts in _seen.items() if ts < cutoff]:
+            del _seen[k]
+        state = {
+            "backoff": _backoff,
+            "poller_running": _poller_thread is not None and _poller_thread.is_alive() and not _stop_event.is_set(),
+            "seen": dict(_seen),
+        }
+    state["directory"] = _directory_state()
+    d = os.path.dirname(SNAPSHOT_PATH) or "."
+    try:
+        fd, tmp = tempfile.mkstemp(prefix=".gateway-state-", dir=d)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"saved_at": time.time(), "state": state}, f)
+        os.replace(tmp, SNAPSHOT_PATH)
+    except Exception as e:
+        app.logger.warning("Snapshot save failed: %s", e)
+
+def _load_snapshot() -> Dict[str, Any]:
+    try:
+        with open(SNAPSHOT_PATH) as f:
+            return (json.load(f) or {}).get("state") or {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        app.logger.warning("Ignoring unreadable snapshot %s: %s", SNAPSHOT_PATH, e)
+        return {}
+
+def _snapshot_loop():
+    while True:
+        time.sleep(SNAPSHOT_INTERVAL)
+        _save_snapshot()
+
+# -------------------------
+# Tracing (W3C traceparent)
+# -------------------------
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+_current_span: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_span", default=None)
+_trace_lock = threading.Lock()
+
+def _parse_traceparent(value: Optional[str]):
+    m = _TRACEPARENT.match((value or "").strip().lower())
+    if not m or m.group(1) == "0" * 32 or m.group(2) == "0" * 16:
+        return None
+    return m.group(1), m.group(2)
+
+@contextmanager
+def _span(name: str, parent: Optional[str] = None, **attrs):
+    """
+    Time a block as a span: a child of the current span, else of `parent` (an inbound
+    traceparent header), else the root of a new trace. Set span["drop"] to skip exporting it.
+    """
+    cur = _current_span.get()
+    ctx = (cur["trace_id"], cur["span_id"]) if cur else _parse_traceparent(parent)
+    span = {"trace_id": ctx[0] if ctx else secrets.token_hex(16), "span_id": secrets.token_hex(8),
+            "parent_id": ctx[1] if ctx else None, "service": SERVICE_NAME, "name": name,
+            "start": time.time(), "status": "ok", "attrs": attrs}
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span["status"] = "error"
+        attrs["error"] = str(e)[:200]
+        raise
+    finally:
+        _current_span.reset(token)
+        span["duration_ms"] = round((time.time() - span["start"]) * 1000, 2)
+        if not span.pop("drop", False):
+            _export_span(span)
+
+def _traceparent(span: Dict[str, Any]) -> str:
+    return f"00-{span['trace_id']}-{span['span_id']}-01"
+
+def _inject(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    headers = dict(headers or {})
+    cur = _current_span.get()
+    if cur:
+        headers["traceparent"] = _traceparent(cur)
+    return headers
+
+def _export_span(span: Dict[str, Any]) -> None:
+    if not TRACE_PATH:
+        return
+    line = json.dumps(span, default=str) + "\n"
+    try:
+        with _trace_lock:
+            os.makedirs(os.path.dirname(TRACE_PATH) or ".", exist_ok=True)
+            for _ in range(3):
+                with open(TRACE_PATH, "a") as f:
+                    fcntl.flock(f, fcntl.LOCK_EX)   # other gunicorn workers append to the same file
+                    st = os.fstat(f.fileno())
+                    try:
+                        current = os.stat(TRACE_PATH)
+                    except FileNotFoundError:
+                        continue
+                    if (st.st_dev, st.st_ino) != (current.st_dev, current.st_ino):
+                        continue   # another worker rotated while we waited for the lock; reopen
+                    if st.st_size > TRACE_MAX_BYTES:
+                        os.replace(TRACE_PATH, TRACE_PATH + ".1")
+                        continue   # write to the fresh file, not the one just rotated
+                    f.write(line)
+                    return
+    except OSError as e:
+        app.logger.warning("Trace export failed: %s", e)
+
+def _read_spans(trace_id: Optional[str], tail_bytes: int = 2_000_000) -> List[Dict[str, Any]]:
+    try:
+        with open(TRACE_PATH, "rb") as f:
+            start = max(0, f.seek(0, os.SEEK_END) - tail_bytes)
+            f.seek(start)
+            lines = f.read().splitlines()
+        if start:
+            lines = lines[1:]   # probably cut mid-line
+    except FileNotFoundError:
+        return []
+    spans = []
+    for line in lines:
+        try:
+            s = json.loads(line)
+        except ValueError:
+            continue
+        if trace_id is None or s.get("trace_id") == trace_id:
+            spans.append(s)
+    return spans
+
+def _group_traces(spans: List[Dict[str, Any]], limit: int) -> List[Dict[str, Any]]:
+    by_trace: Dict[str, List[Dict[str, Any]]] = {}
+    for s in spans:
+        by_trace.setdefault(s["trace_id"], []).append(s)
+    out = []
+    for trace_id, group in by_trace.items():
+        group.sort(key=lambda s: s["start"])
+        t0 = group[0]["start"]
+        end = max(s["start"] + s["duration_ms"] / 1000 for s in group)
+        ids = {s["span_id"] for s in group}
+        out.append({
+            "trace_id": trace_id,
+            "root": next((s["name"] for s in group if s["parent_id"] not in ids), group[0]["name"]),
+            "start": t0,
+            "duration_ms": round((end - t0) * 1000, 2),
+            "spans": [dict(s, offset_ms=round((s["start"] - t0) * 1000, 2)) for s in group],
+        })
+    out.sort(key=lambda t: t["start"], reverse=True)
+    return out[:limit]
+
+# -------------------------
+# Group / contact directory
+# -------------------------
+# Each worker keeps its own copy: ids <-> names and group members, so inbound messages can be
+# enriched and /send can take group names without a signal-api round trip per message.
+_dir_lock = threading.Lock()
+_dir_refresh_lock = threading.Lock()  # one refresh at a time per worker
+_dir_wake = threading.Event()         # set on a lookup miss to refresh ahead of the TTL
+_groups: Dict[str, Dict[str, Any]] = {}    # "group.…" id -> {id, internal_id, name, members}
+_contacts: Dict[str, Dict[str, Any]] = {}  # number (or uuid) -> {number, uuid, name}
+_group_keys: Dict[str, List[str]] = {}     # internal id / casefolded name -> group ids
+_contact_keys: Dict[str, List[str]] = {}   # uuid / casefolded name -> contact keys
+_dir_stats = {"refreshed_at": 0.0, "refreshes": 0, "changed": 0, "errors": 0, "hits": 0, "misses": 0}
+_ADDRESS = re.compile(r"^\+?[\d\s().-]+$")  # phone numbers, with or without "+" and separators
+_UUID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$", re.I)
+
+def _group_entry(g: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if not g.get("id"):
+        return None
+    return {"id": g["id"], "internal_id": g.get("internal_id"), "name": g.get("name") or "",
+            "members": sorted(m for m in (g.get("members") or []) if isinstance(m, str))}
+
+def _contact_entry(c: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    if not (c.get("number") or c.get("uuid")):
+        return None
+    name = c.get("name") or c.get("profile_name") or c.get("username") or ""
+    return {"number": c.get("number"), "uuid": c.get("uuid"), "name": name}
+
+def _merge(table: Dict[str, Dict[str, Any]], fresh: Dict[str, Dict[str, Any]]) -> int:
+    """Apply a fresh listing in place; returns how many entries were added, changed or removed."""
+    changed = 0
+    for k, v in fresh.items():
+        if table.get(k) != v:
+            table[k] = v
+            changed += 1
+    for k in [k for k in table if k not in fresh]:
+        del table[k]
+        changed += 1
+    return changed
+
+def _reindex() -> None:
+    _group_keys.clear()
+    for gid, g in _groups.items():
+        for k in {g["internal_id"], g["name"].casefold()} - {None, ""}:
+            _group_keys.setdefault(k, []).append(gid)
+    _contact_keys.clear()
+    for key, c in _contacts.items():
+        for k in {c["uuid"], c["name"].casefold()} - {None, ""}:
+            _contact_keys.setdefault(k, []).append(key)
+
+def _load_directory(snap: Dict[str, Any]) -> None:
+    groups = {e["id"]: e for e in map(_group_entry, snap.get("groups") or []) if e}
+    contacts = {e["number"] or e["uuid"]: e for e in map(_contact_entry, snap.get("contacts") or []) if e}
+    with _dir_lock:
+        _merge(_groups, groups)
+        _merge(_contacts, contacts)
+        _reindex()
+        _dir_stats["refreshed_at"] = float(snap.get("refreshed_at") or 0)
+
+def _directory_state() -> Dict[str, Any]:
+    with _dir_lock:
+        return {"refreshed_at": _dir_stats["refreshed_at"],
+                "groups": list(_groups.values()), "contacts": list(_contacts.values())}
+
+def _fetch_listing(kind: str) -> List[Dict[str, Any]]:
+    r = requests.get(f"{SIG_BASE}/v1/{kind}/{SIG_NUMBER}", headers=_inject(), timeout=HTTP_TIMEOUT)
+    r.raise_for_status()
+    data = r.json()
+    if not isinstance(data, list):
+        raise ValueError(f"Unexpected {kind} response shape")
+    return [d for d in data if isinstance(d, dict)]
+
+def _refresh_directory(reason: str = "ttl") -> Dict[str, Any]:
+    if not _directory_enabled():
+        return {"ok": False, "error": "directory disabled"}
+    with _dir_refresh_lock, _span("directory.refresh", reason=reason) as sp:
+        try:
+            groups = {e["id"]: e for e in map(_group_entry, _fetch_listing("groups")) if e}
+            contacts = {e["number"] or e["uuid"]: e for e in map(_contact_entry, _fetch_listing("contacts")) if e}
+        except Exception as e:
+            with _dir_lock:
+                _dir_stats["errors"] += 1
+            sp["status"] = "error"
+            sp["attrs"]["error"] = str(e)[:200]
+            app.logger.warning("Directory refresh failed: %s", e)
+            return {"ok": False, "error": str(e)}
+        with _dir_lock:
+            # only what changed is replaced; the indexes are rebuilt only if anything did
+            changed = _merge(_groups, groups) + _merge(_contacts, contacts)
+            if changed:
+                _reindex()
+            _dir_stats["refreshed_at"] = time.time()
+            _dir_stats["refreshes"] += 1
+            _dir_stats["changed"] += changed
+        sp["attrs"].update(groups=len(groups), contacts=len(contacts), changed=changed)
+        if not changed and reason == "ttl":
+            sp["drop"] = True
+        return {"ok": True, "groups": len(groups), "contacts": len(contacts), "changed": changed}
+
+def _directory_miss() -> None:
+    with _dir_lock:
+        _dir_stats["misses"] += 1
+        due = time.time() - _dir_stats["refreshed_at"] >= DIRECTORY_MIN_REFRESH
+    if due:
+        _dir_wake.set()
+
+def _directory_loop() -> None:
+    with _dir_lock:
+        # a directory restored from the snapshot is good until its TTL runs out
+        wait = _dir_stats["refreshed_at"] + DIRECTORY_TTL - time.time()
+    while True:
+        if wait > 0:
+            _dir_wake.wait(wait)
+        reason = "miss" if _dir_wake.is_set() else "ttl"
+        _dir_wake.clear()
+        res = _refresh_directory(reason)
+        wait = DIRECTORY_TTL if res.get("ok") else min(DIRECTORY_TTL, 30)
+
+def _find(keys: Dict[str, List[str]], table: Dict[str, Dict[str, Any]], key: str) -> List[Dict[str, Any]]:
+    if key in table:
+        return [table[key]]
+    return [table[k] for k in keys.get(key, keys.get(key.casefold(), []))]
+
+def _lookup_group(key: str) -> Optional[Dict[str, Any]]:
+    """A group by id, internal id (as in inbound groupInfo) or name; None if unknown or ambiguous."""
+    with _dir_lock:
+        found = _find(_group_keys, _groups, key)
+        if found:
+            _dir_stats["hits"] += 1
+    if not found:
+        _directory_miss()
+    return dict(found[0]) if len(found) == 1 else None
+
+def _lookup_contact(number: Optional[str], uuid: Optional[str]) -> Optional[Dict[str, Any]]:
+    with _dir_lock:
+        found = _find(_contact_keys, _contacts, number) if number else []
+        found = found or (_find(_contact_keys, _contacts, uuid) if uuid else [])
+        _dir_stats["hits" if found else "misses"] += 1
+    return dict(found[0]) if len(found) == 1 else None
+
+def _looks_like_name(r: Any) -> bool:
+    """Only these are looked up; numbers, ids and usernames go to signal-api as given."""
+    return (isinstance(r, str) and not _ADDRESS.match(r) and not r.startswith(("group.", "u:", "username:"))
+            and not _UUID.match(r))
+
+def _resolve_recipients(recipients: List[Any]) -> Tuple[List[Any], Dict[str, str], List[str], List[str]]:
+    """
+    Map group (or contact) names to the ids signal-api sends to. Anything that isn't
+    a known name passes through unchanged, as does everything when the directory is
+    disabled. Returns (recipients, {name: id}, ambiguous, unknown names).
+    """
+    out: List[Any] = []
+    resolved: Dict[str, str] = {}
+    ambiguous: List[str] = []
+    unknown: List[str] = []
+    for r in recipients:
+        if not _directory_enabled() or not _looks_like_name(r):
+            out.append(r)
+            continue
+        with _dir_lock:
+            groups = _find(_group_keys, _groups, r)
+            contacts = [] if groups else _find(_contact_keys, _contacts, r)
+            _dir_stats["hits" if groups or contacts else "misses"] += 1
+        matches = [g["id"] for g in groups] or [c["number"] or c["uuid"] for c in contacts]
+        if len(matches) == 1:
+            resolved[r] = matches[0]
+            out.append(matches[0])
+        elif matches:
+            ambiguous.append(r)    # a name shared by several groups/contacts
+        else:
+            unknown.append(r)
+            out.append(r)
+    return out, resolved, ambiguous, unknown
+
+def _directory_enabled() -> bool:
+    return bool(SIG_NUMBER) and DIRECTORY_TTL > 0
+
+def _start_directory() -> None:
+    if not _directory_enabled():
+        return
+    # every worker serves lookups from its own copy; warm it from the snapshot
+    _load_directory(_load_snapshot().get("directory") or {})
+    threading.Thread(target=_directory_loop, name="directory", daemon=True).start()
+
 def _allowed(sender: str) -> bool:
     if "*" in ALLOW_SENDERS:
         return True
@@ -39,12 +437,20 @@ def _allowed(sender: str) -> bool:
 
 def _normalize(envelope: Dict[str, Any]) -> Dict[str, Any]:
     dm = envelope.get("dataMessage") or {}
+    gid = (dm.get("groupInfo") or {}).get("groupId")
+    group = None
+    if gid:
+        # unknown groups still get the same shape; the miss schedules a directory refresh
+        group = _lookup_group(gid) or {"id": None, "internal_id": gid, "name": None, "members": []}
+    contact = _lookup_contact(envelope.get("sourceNumber") or envelope.get("source"), envelope.get("sourceUuid"))
     return {
         "transport": "signal",
         "sender": envelope.get("source"),
+        "senderName": (contact or {}).get("name") or envelope.get("sourceName"),
         "timestamp": envelope.get("timestamp"),  # ms
         "text": dm.get("message"),
         "groupInfo": dm.get("groupInfo"),
+        "group": group,
         "raw": envelope,
     }
 
@@ -52,20 +458,34 @@ def _forward(payload: Dict[str, Any]) -> None:
     if not (INBOX_URL and INBOX_TOKEN):
         return
     try:
-        r = requests.post(
-            INBOX_URL,
-            json=payload,
-            headers={
-                "Authorization": f"Bearer {INBOX_TOKEN}",
-                "Content-Type": "application/json",
-            },
-            timeout=HTTP_TIMEOUT,
-        )
-        r.raise_for_status()
+        with _span("inbox.forward") as sp:
+            r = requests.post(
+                INBOX_URL,
+                json=payload,
+                headers=_inject({
+                    "Authorization": f"Bearer {INBOX_TOKEN}",
+                    "Content-Type": "application/json",
+                }),
+                timeout=HTTP_TIMEOUT,
+            )
+            sp["attrs"]["status"] = r.status_code
+            r.raise_for_status()
     except Exception as e:
         app.logger.exception("Inbox forward failed: %s", e)
 
 def _receive_once() -> Dict[str, Any]:
+    # one trace per poll that delivered something (or failed); empty long-polls aren't exported
+    with _span("signal.receive") as sp:
+        res = _receive_envelopes()
+        sp["attrs"].update({k: res[k] for k in ("status", "received", "forwarded", "dropped") if k in res})
+        if not res.get("ok", False):
+            sp["status"] = "error"
+            sp["attrs"]["error"] = str(res.get("error"))[:200]
+        elif not res.get("received"):
+            sp["drop"] = True
+        return res
+
+def _receive_envelopes() -> Dict[str, Any]:
     """
     Hit signal-cli-rest-api receive once (long-poll). Returns summary + raw items (limited).
     """
@@ -93,16 +513,21 @@ def _receive_once() -> Dict[str, Any]:
             if not sender or not text:
                 continue
 
+            if _seen_before(f"{sender}:{env.get('timestamp')}"):
+                continue
+
             received += 1
             if not _allowed(sender):
                 dropped += 1
                 app.logger.warning("Dropping non-allowed sender: %s", sender)
                 continue
 
-            payload = _normalize(env)
-            if ENABLE_FORWARD:
-                _forward(payload)
-                forwarded += 1
+            ts = env.get("timestamp")
+            with _span("inbound", lag_ms=round(time.time() * 1000 - ts) if isinstance(ts, (int, float)) else None):
+                payload = _normalize(env)
+                if ENABLE_FORWARD:
+                    _forward(payload)
+                    forwarded += 1
 
             # include up to 5 sample items in response for visibility
             if len(samples) < 5:
@@ -181,20 +606,92 @@ def receive_once():
         return jsonify({"error": "unexpected_exception", "detail": str(e)}), 500
 
 def _poll_loop():
-    app.logger.info("Signal poller started (timeout=%s, forward=%s)", RECEIVE_TIMEOUT, ENABLE_FORWARD)
-    backoff = 1
+    global _backoff
+    app.logger.info("Signal poller started (timeout=%s, forward=%s, backoff=%s)", RECEIVE_TIMEOUT, ENABLE_FORWARD, _backoff)
     while not _stop_event.is_set():
         res = _receive_once()
         # Reset backoff on a normal/empty receive
         if res.get("ok", False):
-            backoff = 1
+            _backoff = 1
         else:
             app.logger.warning("receive_once error: %s", res)
-            time.sleep(backoff)
-            backoff = min(backoff * 2, 30)
+            time.sleep(_backoff)
+            _backoff = min(_backoff * 2, 30)
 
     app.logger.info("Signal poller stopped.")
 
+# -------------------------
+# Idempotent sends
+# -------------------------
+# Senders retry /send after a timeout, when the first attempt may already have reached Signal.
+# Keys live in SQLite rather than memory so a retry that lands on another worker is still caught.
+_idem_lock = threading.Lock()
+_idem_conn: Optional[sqlite3.Connection] = None
+_idem_failed = False
+_idem_pruned = 0.0
+
+def _idem_db() -> Optional[sqlite3.Connection]:
+    global _idem_conn, _idem_failed
+    if _idem_conn is None and not _idem_failed:
+        try:
+            os.makedirs(os.path.dirname(IDEMPOTENCY_DB) or ".", exist_ok=True)
+            db = sqlite3.connect(IDEMPOTENCY_DB, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("CREATE TABLE IF NOT EXISTS sends (key TEXT PRIMARY KEY, at REAL NOT NULL, "
+                       "status INTEGER, body TEXT)")   # status NULL = in flight
+            _idem_conn = db
+        except (OSError, sqlite3.Error) as e:
+            _idem_failed = True
+            app.logger.warning("Idempotency keys disabled (%s): %s", IDEMPOTENCY_DB, e)
+    return _idem_conn
+
+def _idem_claim(key: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+    """
+    None if this request owns `key` and should send; otherwise the response to return:
+    the stored one, or 503 while another attempt with the key is still in flight.
+    """
+    global _idem_pruned
+    now = time.time()
+    with _idem_lock:
+        db = _idem_db()
+        if db is None:
+            return None
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if now - _idem_pruned > 60:
+                    db.execute("DELETE FROM sends WHERE at < ?", (now - IDEMPOTENCY_TTL,))
+                    _idem_pruned = now
+                row = db.execute("SELECT at, status, body FROM sends WHERE key = ?", (key,)).fetchone()
+                # an in-flight claim older than any send can take was left by a crashed worker
+                if row is None or (row[1] is None and now - row[0] > 2 * HTTP_TIMEOUT):
+                    db.execute("INSERT OR REPLACE INTO sends (key, at) VALUES (?, ?)", (key, now))
+                    row = None
+            finally:
+                db.execute("COMMIT")
+        except sqlite3.Error as e:
+            app.logger.warning("Idempotency check failed for %s: %s", key, e)
+            return None
+    if row is None:
+        return None
+    if row[1] is None:
+        return 503, {"ok": False, "error": "A send with this Idempotency-Key is in progress"}
+    return row[1], json.loads(row[2])
+
+def _idem_settle(key: str, status: Optional[int], body: Optional[Dict[str, Any]]) -> None:
+    """Store the response for `key`; status None forgets the key so a retry sends again."""
+    with _idem_lock:
+        db = _idem_db()
+        if db is None:
+            return
+        try:
+            if status is None:
+                db.execute("DELETE FROM sends WHERE key = ? AND status IS NULL", (key,))
+            else:
+                db.execute("UPDATE sends SET status = ?, body = ? WHERE key = ?", (status, json.dumps(body), key))
+        except sqlite3.Error as e:
+            app.logger.warning("Idempotency update failed for %s: %s", key, e)
+
 # -------------------------
 # Routes
 # -------------------------
@@ -206,6 +703,7 @@ def health():
         "number": SIG_NUMBER[:4] + "…" if SIG_NUMBER else "",
         "forward_enabled": ENABLE_FORWARD,
         "poller_running": _poller_thread is not None and _poller_thread.is_alive(),
+        "directory": _directory_summary(),
     })
 
 @app.get("/config")
@@ -220,8 +718,32 @@ def config():
         "INBOX_URL_set": bool(INBOX_URL),
         "INBOX_TOKEN_preview": redacted_token,
         "ALLOW_SENDERS": list(ALLOW_SENDERS),
+        "DIRECTORY_TTL": DIRECTORY_TTL,
     })
 
+def _directory_summary() -> Dict[str, Any]:
+    with _dir_lock:
+        at = _dir_stats["refreshed_at"]
+        return dict(_dir_stats, groups=len(_groups), contacts=len(_contacts),
+                    age_s=round(time.time() - at) if at else None)
+
+@app.get("/directory")
+def directory():
+    """Groups and contacts as the gateway knows them; ?q= filters by name, id or number."""
+    q = (request.args.get("q") or "").casefold()
+    state = _directory_state()
+    if q:
+        def match(e):
+            return any(q in (v or "").casefold() for k, v in e.items() if k != "members")
+        state["groups"] = [g for g in state["groups"] if match(g)]
+        state["contacts"] = [c for c in state["contacts"] if match(c)]
+    return jsonify(state)
+
+@app.post("/directory/refresh")
+def directory_refresh():
+    res = _refresh_directory("manual")
+    return jsonify(res), 200 if res.get("ok") else 502
+
 @app.post("/send")
 def send():
     if not SIG_NUMBER:
@@ -238,12 +760,52 @@ def send():
     if recipients is None:
         return jsonify({"error": "Field 'to' must be string or list"}), 400
 
+    requested = recipients
+    recipients, resolved, ambiguous, unknown = _resolve_recipients(requested)
+    if unknown and time.time() - _directory_summary()["refreshed_at"] >= DIRECTORY_MIN_REFRESH:
+        # maybe a group created since the last refresh: resolve the original list once more
+        _refresh_directory("miss")
+        recipients, resolved, ambiguous, unknown = _resolve_recipients(requested)
+    if ambiguous:
+        return jsonify({"error": "Ambiguous recipient name(s)", "ambiguous": ambiguous}), 400
+
+    idem_key = (request.headers.get("Idempotency-Key") or "").strip()[:200] if IDEMPOTENCY_TTL > 0 else ""
     payload = {"number": SIG_NUMBER, "recipients": recipients, "message": message}
+    with _span("gateway.send", parent=request.headers.get("traceparent"), recipients=len(recipients),
+               idempotency_key=idem_key[:12] or None) as sp:
+        replay = _idem_claim(idem_key) if idem_key else None
+        if replay is not None:
+            sp["attrs"]["replayed"] = True
+            return jsonify(replay[1]), replay[0], {"traceparent": _traceparent(sp)}
+        try:
+            with _span("signal.v2_send") as up:
+                resp = requests.post(f"{SIG_BASE}/v2/send", json=payload, headers=_inject(), timeout=HTTP_TIMEOUT)
+                up["attrs"]["status"] = resp.status_code
+            if not resp.ok:
+                sp["status"] = "error"
+            body = {"ok": resp.ok, "status": resp.status_code, "response": resp.text}
+            if resolved:
+                body["resolved"] = resolved
+            if idem_key:
+                # signal-api's own 5xx means nothing went out: let the retry send it
+                _idem_settle(idem_key, None if resp.status_code >= 500 else resp.status_code, body)
+            return jsonify(body), resp.status_code, {"traceparent": _traceparent(sp)}
+        except Exception as e:
+            sp["status"] = "error"
+            sp["attrs"]["error"] = str(e)[:200]
+            if idem_key:
+                _idem_settle(idem_key, None, None)
+            return jsonify({"ok": False, "error": str(e)}), 500, {"traceparent": _traceparent(sp)}
+
+@app.get("/debug/traces")
+def debug_traces():
+    # read from the shared trace file, not memory: each gunicorn worker only sees its own requests
+    trace_id = request.args.get("trace_id") or None
     try:
-        resp = requests.post(f"{SIG_BASE}/v2/send", json=payload, timeout=HTTP_TIMEOUT)
-        return jsonify({"ok": resp.ok, "status": resp.status_code, "response": resp.text}), resp.status_code
-    except Exception as e:
-        return jsonify({"ok": False, "error": str(e)}), 500
+        limit = max(1, min(int(request.args.get("limit", 20)), 200))
+    except ValueError:
+        return jsonify({"error": "Field 'limit' must be an integer"}), 400
+    return jsonify(_group_traces(_read_spans(trace_id), limit))
 
 #@app.post("/receive_once")
 #def receive_once():
@@ -253,9 +815,15 @@ def send():
 #    code = 200 if result.get("ok", False) else 500
 #    return jsonify(result), code
 
+def _start_poller_thread() -> None:
+    global _poller_thread
+    _stop_event.clear()
+    _started_flag.set()
+    _poller_thread = threading.Thread(target=_poll_loop, name="signal-receive-poller", daemon=True)
+    _poller_thread.start()
+
 @app.post("/start_poller")
 def start_poller():
-    global _poller_thread
     if not SIG_NUMBER:
         return jsonify({"error": "SIGNAL_NUMBER not configured"}), 400
     if _poller_thread and _poller_thread.is_alive():
@@ -268,10 +836,10 @@ def start_poller():
         except Exception:
             pass
 
-    _stop_event.clear()
-    _started_flag.set()
-    _poller_thread = threading.Thread(target=_poll_loop, name="signal-receive-poller", daemon=True)
-    _poller_thread.start()
+    if not _claim_snapshot():
+        app.logger.warning("Poller started in a worker that doesn't own the snapshot; its state won't persist")
+    _start_poller_thread()
+    _save_snapshot()
     return jsonify({"ok": True, "message": "poller started"}), 202
 
 @app.post("/stop_poller")
@@ -282,8 +850,32 @@ def stop_poller():
         # give it a moment to exit
         _poller_thread.join(timeout=1.0)
     running = _poller_thread is not None and _poller_thread.is_alive()
+    _save_snapshot()
     return jsonify({"ok": True, "poller_running": running})
 
+# -------------------------
+# Warm restart
+# -------------------------
+def _restore() -> None:
+    global _backoff
+    if not _claim_snapshot():
+        return
+    snap = _load_snapshot()
+    cutoff = time.time() - DEDUP_WINDOW
+    with _state_lock:
+        _backoff = max(1, min(int(snap.get("backoff") or 1), 30))
+        _seen.update({k: ts for k, ts in (snap.get("seen") or {}).items() if ts >= cutoff})
+    if snap:
+        app.logger.info("Restored snapshot: poller_running=%s backoff=%s seen=%d",
+                        snap.get("poller_running"), _backoff, len(_seen))
+    if snap.get("poller_running") and SIG_NUMBER:
+        _start_poller_thread()
+    threading.Thread(target=_snapshot_loop, name="snapshot", daemon=True).start()
+    atexit.register(_save_snapshot)
+
+_restore()
+_start_directory()
+
 # -------------------------
 # Dev run
 # -------------------------
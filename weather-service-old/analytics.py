@@ -0,0 +1,134 @@
+"""
+Vectorized forecast analytics.
+
+Every function takes a (locations x hours) or (locations x days) matrix, so a
+morning run for hundreds of subscribers is one pass of NumPy ops instead of a
+Python loop per location per hour. Missing values are NaN and never count as
+crossing a threshold.
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+
+def matrix(series: Sequence[Optional[Sequence]], width: Optional[int] = None) -> np.ndarray:
+    """Stack ragged per-location series into a float matrix, NaN-padded (None -> NaN)."""
+    width = width if width is not None else max((len(s) for s in series if s), default=0)
+    out = np.full((len(series), width), np.nan)
+    for i, s in enumerate(series):
+        if s:
+            row = np.array([np.nan if v is None else v for v in s[:width]], dtype=float)
+            out[i, :len(row)] = row
+    return out
+
+
+def runs(mask: np.ndarray) -> List[List[tuple]]:
+    """Per row, the [start, end) column spans where `mask` is True."""
+    padded = np.zeros((mask.shape[0], mask.shape[1] + 2), dtype=np.int8)
+    padded[:, 1:-1] = mask
+    edges = np.diff(padded, axis=1)
+    starts_r, starts_c = np.nonzero(edges == 1)
+    ends_c = np.nonzero(edges == -1)[1]   # same row-major order as starts, one end per start
+    out: List[List[tuple]] = [[] for _ in range(mask.shape[0])]
+    for r, s, e in zip(starts_r.tolist(), starts_c.tolist(), ends_c.tolist()):
+        out[r].append((s, e))
+    return out
+
+
+def rain_windows(prob: np.ndarray, threshold: float) -> List[List[dict]]:
+    """Spans of hours with precipitation probability >= threshold, with their peak."""
+    spans = runs(prob >= threshold)
+    out = []
+    for r, row in enumerate(spans):
+        out.append([{"start": s, "end": e, "peak": int(np.nanmax(prob[r, s:e]))} for s, e in row])
+    return out
+
+
+def crossings(values: np.ndarray, threshold: float) -> List[List[dict]]:
+    """Hours where a series goes above (`up`) or back below (`down`) a threshold."""
+    above = values >= threshold
+    change = np.zeros_like(above, dtype=np.int8)
+    change[:, 1:] = np.diff(above.astype(np.int8), axis=1)
+    change[:, 0] = above[:, 0]   # already above at the first hour counts as a crossing
+    out: List[List[dict]] = [[] for _ in range(values.shape[0])]
+    for r, c in zip(*np.nonzero(change)):
+        out[r].append({"hour": int(c), "dir": "up" if change[r, c] > 0 else "down"})
+    return out
+
+
+def peaks(values: np.ndarray) -> Dict[str, np.ndarray]:
+    """Per-row max and the column it occurs at (-1 for all-NaN rows)."""
+    valid = ~np.isnan(values).all(axis=1)
+    filled = np.where(np.isnan(values), -np.inf, values)
+    idx = np.where(valid, filled.argmax(axis=1), -1)
+    val = np.where(valid, filled.max(axis=1), np.nan)
+    return {"index": idx, "value": val}
+
+
+def trend(values: np.ndarray) -> np.ndarray:
+    """Least-squares slope per row (units per column), ignoring NaNs."""
+    x = np.arange(values.shape[1], dtype=float)
+    ok = ~np.isnan(values)
+    n = ok.sum(axis=1)
+    xm = np.where(ok, x, 0).sum(axis=1) / np.maximum(n, 1)
+    ym = np.where(ok, values, 0).sum(axis=1) / np.maximum(n, 1)
+    dx = np.where(ok, x - xm[:, None], 0)
+    dy = np.where(ok, values - ym[:, None], 0)
+    den = (dx * dx).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where((n >= 2) & (den > 0), (dx * dy).sum(axis=1) / den, np.nan)
+
+
+def analyze_hourly(forecasts: Sequence[dict], hours: int, rain: float, heat: float, uv: float,
+                   wind: float) -> List[dict]:
+    """
+    Summaries of the first `hours` hourly points of each forecast: rain windows,
+    peak heat, and UV/wind/heat threshold crossings. Hours are column indexes;
+    each forecast's hourly["time"] maps them back to local times.
+    """
+    hourly = [f.get("hourly") or {} for f in forecasts]
+    temp = matrix([h.get("temperature_2m") for h in hourly], hours)
+    prob = matrix([h.get("precipitation_probability") for h in hourly], hours)
+    uvi = matrix([h.get("uv_index") for h in hourly], hours)
+    wnd = matrix([h.get("wind_speed_10m") for h in hourly], hours)
+
+    windows = rain_windows(prob, rain)
+    hot = peaks(temp)
+    uv_peak = peaks(uvi)
+    wind_peak = peaks(wnd)
+    heat_x, uv_x, wind_x = crossings(temp, heat), crossings(uvi, uv), crossings(wnd, wind)
+    out = []
+    for i in range(len(forecasts)):
+        out.append({
+            "rain_windows": windows[i],
+            "peak_temp": {"hour": int(hot["index"][i]), "value": _num(hot["value"][i])},
+            "peak_uv": {"hour": int(uv_peak["index"][i]), "value": _num(uv_peak["value"][i])},
+            "peak_wind": {"hour": int(wind_peak["index"][i]), "value": _num(wind_peak["value"][i])},
+            "crossings": {"heat": heat_x[i], "uv": uv_x[i], "wind": wind_x[i]},
+        })
+    return out
+
+
+def analyze_daily(forecasts: Sequence[dict]) -> List[dict]:
+    """Multi-day digest numbers: per-day arrays plus hi/lo trend and the wettest day."""
+    daily = [f.get("daily") or {} for f in forecasts]
+    hi = matrix([d.get("temperature_2m_max") for d in daily])
+    lo = matrix([d.get("temperature_2m_min") for d in daily], hi.shape[1])
+    prob = matrix([d.get("precipitation_probability_max") for d in daily], hi.shape[1])
+    hi_slope, lo_slope = trend(hi), trend(lo)
+    wet = peaks(prob)
+    out = []
+    for i in range(len(forecasts)):
+        out.append({
+            "hi_trend": _num(hi_slope[i]),
+            "lo_trend": _num(lo_slope[i]),
+            "wettest_day": int(wet["index"][i]),
+            "wettest_prob": _num(wet["value"][i]),
+            "hi_range": [_num(np.nanmin(hi[i])) if not np.isnan(hi[i]).all() else None,
+                         _num(np.nanmax(hi[i])) if not np.isnan(hi[i]).all() else None],
+        })
+    return out
+
+
+def _num(v) -> Optional[float]:
+    return None if v is None or np.isnan(v) else round(float(v), 1)
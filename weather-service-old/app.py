@@ -1,17 +1,41 @@
 import os
+import json
 import time
+import uuid
+import hashlib
+import atexit
+import asyncio
 import threading
-from typing import Optional, Tuple
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+import httpx
 import requests
-from croniter import croniter
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import pytz
 
-from fastapi import FastAPI, Query
+import analytics
+import tracing
+
+from urllib.parse import urlsplit
+
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.responses import JSONResponse
+from pydantic import BaseModel
 import uvicorn
 
+from snapshot import load_snapshot, save_snapshot
+from geocache import GeoCache
+from gazetteer import Gazetteer
+from forecast_cache import ForecastCache
+from subscribers import DETAIL_LEVELS, SubscriberRegistry
+from scheduler import Scheduler
+from delivery import DeliveryQueue
+from watch import Watcher
+from archive import AGGREGATES, ForecastArchive
+from providers import DAILY_FIELDS, HOURLY_FIELDS, PROVIDERS, Hedger
+
 # ------------ Config ------------
 CITY = os.getenv("CITY", "Orlando")
 STATE = os.getenv("STATE", "FL")
@@ -22,7 +46,83 @@ SOURCE_NAME = os.getenv("SOURCE_NAME", "weather-service")
 NOTIFY_TO = os.getenv("NOTIFY_TO", "")
 NOTIFY_TOKEN = os.getenv("NOTIFY_TOKEN", "")
 
+# Warm-restart state (last/next run) survives redeploys when DATA_DIR is a volume
+DATA_DIR = os.getenv("DATA_DIR", "./data")
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(DATA_DIR, "weather-state.json"))
+SNAPSHOT_INTERVAL = int(os.getenv("SNAPSHOT_INTERVAL", "60"))   # seconds
+
+# Scheduler: heap of cron jobs (the env job + one per subscriber) on a bounded worker pool
+SCHED_WORKERS = int(os.getenv("SCHED_WORKERS", "4"))
+MISFIRE_GRACE = int(os.getenv("MISFIRE_GRACE", "3600"))         # a slot missed by more than this is not caught up...
+MISFIRE_POLICY = os.getenv("MISFIRE_POLICY", "coalesce")        # ...except under "all" (skip | coalesce | all)
+SCHED_JITTER = float(os.getenv("SCHED_JITTER", "0"))            # max random delay (seconds) per fire instant
+PREWARM_LEAD = int(os.getenv("PREWARM_LEAD", "300"))            # fetch + render this long before a fire (0 = off)
+
+# Persistent geocode cache (LRU + TTL, with short-lived negative entries)
+GEOCACHE_PATH = os.getenv("GEOCACHE_PATH", os.path.join(DATA_DIR, "geocode-cache.json"))
+GEOCACHE_TTL = int(os.getenv("GEOCACHE_TTL", str(30 * 86400)))     # seconds
+GEOCACHE_NEG_TTL = int(os.getenv("GEOCACHE_NEG_TTL", "600"))       # seconds
+GEOCACHE_MAX = int(os.getenv("GEOCACHE_MAX", "5000"))              # entries
+GEOCODE_WORKERS = int(os.getenv("GEOCODE_WORKERS", "8"))           # concurrent variant lookups (shared pool)
+GEOCODE_HEDGE_DELAY = float(os.getenv("GEOCODE_HEDGE_DELAY", "0.5"))  # seconds a variant runs alone before the next joins
+# Optional offline US place index (see gazetteer.py); geocode() falls back to the network on a miss
+GAZETTEER_PATH = os.getenv("GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gazetteer.idx"))
+
+# Forecast cache: fresh until the next model update, then served stale while refreshing
+FORECAST_CADENCE = int(os.getenv("FORECAST_CADENCE", "3600"))     # seconds between upstream model updates
+FORECAST_PUBLISH_LAG = int(os.getenv("FORECAST_PUBLISH_LAG", "900"))  # new run shows up this long after the boundary
+FORECAST_MAX_STALE = int(os.getenv("FORECAST_MAX_STALE", "21600"))  # never serve older than fresh-until + this
+FORECAST_CACHE_MAX = int(os.getenv("FORECAST_CACHE_MAX", "2000"))   # entries
+FORECAST_BATCH_SIZE = int(os.getenv("FORECAST_BATCH_SIZE", "50"))    # locations per upstream request
+FORECAST_BATCH_WORKERS = int(os.getenv("FORECAST_BATCH_WORKERS", "4"))  # concurrent chunk requests
+FORECASTS_MAX_LOCATIONS = int(os.getenv("FORECASTS_MAX_LOCATIONS", "500"))  # per POST /forecasts
+
+# Durable notify: messages go to a local SQLite outbox drained by a worker with retries
+OUTBOX_DB = os.getenv("OUTBOX_DB", os.path.join(DATA_DIR, "outbox.db"))
+DELIVERY_DEADLINE = int(os.getenv("DELIVERY_DEADLINE", "3600"))      # give up on a message after this many seconds
+DELIVERY_MAX_BACKOFF = int(os.getenv("DELIVERY_MAX_BACKOFF", "300"))  # cap between retries
+
+# Message detail thresholds (forecast units: °C, %, km/h)
+RAIN_THRESHOLD = float(os.getenv("RAIN_THRESHOLD", "50"))
+HEAT_THRESHOLD = float(os.getenv("HEAT_THRESHOLD", "32"))
+UV_THRESHOLD = float(os.getenv("UV_THRESHOLD", "6"))
+WIND_THRESHOLD = float(os.getenv("WIND_THRESHOLD", "40"))
+
+# Subscriber registry (per-user city/tz/cron/recipient); the env-configured CITY/CRON job keeps running too
+SUBSCRIBERS_DB = os.getenv("SUBSCRIBERS_DB", os.path.join(DATA_DIR, "subscribers.db"))
+
+# Watch mode: on WATCH_CRON, re-check the places of subscribers with alerts on and send a short
+# alert when the next WATCH_DAYS days' forecast gets worse by a threshold (empty WATCH_CRON = off)
+WATCH_CRON = os.getenv("WATCH_CRON", "*/30 * * * *")
+WATCH_PATH = os.getenv("WATCH_PATH", os.path.join(DATA_DIR, "watch-state.json"))
+WATCH_DAYS = int(os.getenv("WATCH_DAYS", "2"))
+ALERT_SEVERITY_JUMP = int(os.getenv("ALERT_SEVERITY_JUMP", "2"))   # weather code severity steps (0-9 scale)
+ALERT_PRECIP_JUMP = float(os.getenv("ALERT_PRECIP_JUMP", "30"))    # precipitation probability points
 
+# Upstream APIs and the shared async client used by the async request path
+GEOCODE_URL = os.getenv("GEOCODE_URL", "https://geocoding-api.open-meteo.com/v1/search")
+FORECAST_URL = os.getenv("FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+
+# Forecast providers in priority order (open-meteo, wttr); the next one is hedged in once the
+# current one is slower than its own recent p95, clamped to [HEDGE_MIN_DELAY, HEDGE_MAX_DELAY]
+FORECAST_PROVIDERS = [p.strip() for p in os.getenv("FORECAST_PROVIDERS", "open-meteo,wttr").split(",") if p.strip()]
+WTTR_URL = os.getenv("WTTR_URL", "https://wttr.in")
+PROVIDER_TIMEOUT = float(os.getenv("PROVIDER_TIMEOUT", "15"))     # per provider call (seconds)
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.05"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "3"))       # also used until a provider has enough samples
+FALLBACK_CACHE_TTL = int(os.getenv("FALLBACK_CACHE_TTL", "300"))  # seconds a non-primary provider's answer is cached
+
+# Forecast archive: every upstream daily forecast, for /history (empty = off)
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(DATA_DIR, "archive"))
+
+# Tracing: W3C traceparent propagated to the gateway; spans kept in memory for /debug/traces and
+# appended as JSON lines to TRACE_PATH (empty = memory only)
+TRACE_PATH = os.getenv("TRACE_PATH", os.path.join(DATA_DIR, "traces.jsonl"))
+TRACE_RING = int(os.getenv("TRACE_RING", "2000"))                  # spans kept in memory
+# services whose /debug/traces are merged into ours when looking up one trace (default: the gateway)
+TRACE_PEERS = [u.strip().rstrip("/") for u in os.getenv("TRACE_PEERS", "").split(",") if u.strip()]
 
 LAT_ENV = os.getenv("LAT")
 LON_ENV = os.getenv("LON")
@@ -38,6 +138,9 @@ STATE_MAP = {
     "TN":"Tennessee","TX":"Texas","UT":"Utah","VT":"Vermont","VA":"Virginia","WA":"Washington",
     "WV":"West Virginia","WI":"Wisconsin","WY":"Wyoming","DC":"District of Columbia",
 }
+STATE_ABBR = {v.upper(): k for k, v in STATE_MAP.items()}
+
+tracing.configure(SOURCE_NAME, TRACE_PATH or None, TRACE_RING)
 
 # ------------ Helpers ------------
 def _tz() -> pytz.BaseTzInfo:
@@ -46,15 +149,66 @@ def _tz() -> pytz.BaseTzInfo:
 def tznow() -> datetime:
     return datetime.now(_tz())
 
-def next_run(after: datetime, cron: str) -> datetime:
-    return croniter(cron, after).get_next(datetime)
+# ------------ Warm-restart state ------------
+_state_lock = threading.Lock()
+_state = {
+    "last_run": None,    # ISO time the last env-configured run finished
+    "jobs": {},          # scheduler.state(): job id -> next/last fire (last dedups a slot across restarts)
+}
 
-def geocode(city: str, state: Optional[str]) -> Tuple[float, float, str]:
-    # 1) Allow explicit lat/lon to bypass geocoding
-    if LAT_ENV and LON_ENV:
-        return float(LAT_ENV), float(LON_ENV), city
+def _restore_state() -> dict:
+    snap = load_snapshot(SNAPSHOT_PATH)
+    with _state_lock:
+        for k in _state:
+            if k in snap:
+                _state[k] = snap[k]
+    if snap:
+        print(f"[state] restored from {SNAPSHOT_PATH} ({len(_state['jobs'])} scheduled job(s))")
+    return snap
+
+def _save_state():
+    jobs = _scheduler.state()
+    with _state_lock:
+        _state["jobs"] = jobs
+        state = dict(_state)
+    save_snapshot(SNAPSHOT_PATH, state)
 
-    # 2) Build a set of increasingly lenient query names
+atexit.register(_save_state)
+
+# ------------ Geocoding ------------
+_geocache = GeoCache(GEOCACHE_PATH, GEOCACHE_TTL, GEOCACHE_NEG_TTL, GEOCACHE_MAX)
+_geocache.load()
+atexit.register(_geocache.save)
+_geo_pool = ThreadPoolExecutor(max_workers=GEOCODE_WORKERS, thread_name_prefix="geocode")
+
+_gazetteer: Optional[Gazetteer] = None
+if GAZETTEER_PATH and os.path.exists(GAZETTEER_PATH):
+    try:
+        _gazetteer = Gazetteer(GAZETTEER_PATH)
+        print(f"[geocode] offline gazetteer: {len(_gazetteer)} places from {GAZETTEER_PATH}")
+    except Exception as e:
+        print(f"[geocode] gazetteer {GAZETTEER_PATH} unusable: {e}")
+
+def _gazetteer_lookup(city: str, state: Optional[str]) -> Optional[Tuple[float, float, str]]:
+    if _gazetteer is None:
+        return None
+    s = " ".join((state or "").upper().split())
+    abbr = STATE_ABBR.get(s, s) if s else None
+    if abbr and abbr not in STATE_MAP:
+        return None  # not a US state — leave it to the network geocoder
+    p = _gazetteer.lookup(city, abbr)
+    if p is None:
+        return None
+    return float(p.lat), float(p.lon), f"{p.name}, {STATE_MAP.get(p.state, p.state)}, United States"
+
+def _geo_key(city: str, state: Optional[str]) -> str:
+    # "  new  york", "New York" and "NEW YORK" share an entry; "Florida" and "FL" too
+    c = " ".join(city.lower().split())
+    s = " ".join((state or "").upper().split())
+    return f"{c}|{STATE_ABBR.get(s, s)}"
+
+def _geocode_queries(city: str, state: Optional[str]) -> List[str]:
+    # Build a set of increasingly lenient query names, highest priority first
     queries = []
     s = (state or "").strip()
     s_full = STATE_MAP.get(s.upper(), s) if s else s
@@ -80,33 +234,102 @@ def geocode(city: str, state: Optional[str]) -> Tuple[float, float, str]:
         f"{city_squeezed}, US",
         f"{city_squeezed}, United States",
     ]
-    queries = [q for q in queries if q]  # drop None
+    return list(dict.fromkeys(q for q in queries if q))  # drop None/duplicates, keep order
 
-    last_err = None
-    for q in queries:
-        try:
-            r = requests.get(
-                "https://geocoding-api.open-meteo.com/v1/search",
-                params={"name": q, "count": 1},
-                timeout=10
-            )
-            r.raise_for_status()
-            data = r.json()
-            if data.get("results"):
-                item = data["results"][0]
-                lat = float(item["latitude"])
-                lon = float(item["longitude"])
-                label = item.get("name") or city_squeezed
-                # Prefer including admin1/country for clarity if present
-                admin1 = item.get("admin1")
-                country = item.get("country")
-                if admin1 and country:
-                    label = f"{label}, {admin1}, {country}"
-                return lat, lon, label
-        except Exception as e:
-            last_err = str(e)
+def _geocode_one(q: str, fallback_label: str) -> Optional[Tuple[float, float, str]]:
+    # None means "no results"; transport/HTTP errors raise
+    with tracing.span("http.geocode", q=q) as sp:
+        r = requests.get(GEOCODE_URL, params={"name": q, "count": 1}, headers=tracing.inject(), timeout=10)
+        sp.set(status=r.status_code)
+        r.raise_for_status()
+        return _parse_geocode(r.json(), fallback_label)
+
+def _parse_geocode(data: dict, fallback_label: str) -> Optional[Tuple[float, float, str]]:
+    if not data.get("results"):
+        return None
+    item = data["results"][0]
+    lat = float(item["latitude"])
+    lon = float(item["longitude"])
+    label = item.get("name") or fallback_label
+    # Prefer including admin1/country for clarity if present
+    admin1 = item.get("admin1")
+    country = item.get("country")
+    if admin1 and country:
+        label = f"{label}, {admin1}, {country}"
+    return lat, lon, label
+
+def _race_queries(queries: List[str], fallback_label: str) -> Tuple[Optional[Tuple[float, float, str]], Optional[str]]:
+    """
+    Try variants in priority order, hedged: the next one starts when every earlier one
+    has come back empty or failed, or when they have run GEOCODE_HEDGE_DELAY without an
+    answer. Returns the first successful answer *in priority order* (same answer the old
+    sequential loop gave), plus the last error. A healthy geocoder sees one request per
+    lookup; variants still queued when the winner is known are cancelled.
+    """
+    futures: List = []
+    head, last_err = 0, None
+    try:
+        while head < len(queries):
+            if head == len(futures):
+                futures.append(_geo_pool.submit(tracing.bind(_geocode_one), queries[head], fallback_label))
+            running = [f for f in futures[head:] if not f.done()]
+            if running:
+                done, _ = wait(running, timeout=GEOCODE_HEDGE_DELAY, return_when=FIRST_COMPLETED)
+                if not done and len(futures) < len(queries):
+                    futures.append(_geo_pool.submit(tracing.bind(_geocode_one), queries[len(futures)], fallback_label))
+            # advance over the settled, highest-priority prefix
+            while head < len(futures) and futures[head].done():
+                try:
+                    place = futures[head].result()
+                except Exception as e:
+                    place, last_err = None, str(e)
+                if place:
+                    return place, last_err
+                head += 1
+    finally:
+        for f in futures:
+            f.cancel()
+    return None, last_err
+
+def _geocode_local(city: str, state: Optional[str]) -> Tuple[str, Optional[Tuple[float, float, str]]]:
+    """Everything geocode() can answer without the network: (cache key, place or None)."""
+    # 1) Allow explicit lat/lon to bypass geocoding
+    if LAT_ENV and LON_ENV:
+        return "", (float(LAT_ENV), float(LON_ENV), city)
+
+    # 2) Offline gazetteer (no network)
+    place = _gazetteer_lookup(city, state)
+    if place:
+        return "", place
+
+    key = _geo_key(city, state)
+    hit, place, err = _geocache.get(key)
+    if hit and place is None:
+        raise ValueError(err)
+    return key, place
 
-    raise ValueError(f"Could not geocode '{city}{','+state if state else ''}' (tried: {queries}) — {last_err or ''}")
+def _geocode_settle(city: str, state: Optional[str], key: str, queries: List[str],
+                    place: Optional[Tuple[float, float, str]], last_err: Optional[str]) -> Tuple[float, float, str]:
+    if place:
+        _geocache.put(key, place)
+        return place
+    msg = f"Could not geocode '{city}{','+state if state else ''}' (tried: {queries}) — {last_err or ''}"
+    if last_err is None:
+        # every variant answered "no results": remember briefly; transport errors are not cached
+        _geocache.put_negative(key, msg)
+    raise ValueError(msg)
+
+def geocode(city: str, state: Optional[str]) -> Tuple[float, float, str]:
+    with tracing.span("geocode", city=city, state=state) as sp:
+        key, place = _geocode_local(city, state)
+        if place:
+            sp.set(source="local")
+            return place
+        # 3) Race the query variants; highest-priority success wins
+        queries = _geocode_queries(city, state)
+        place, last_err = _race_queries(queries, city.strip())
+        sp.set(source="network")
+        return _geocode_settle(city, state, key, queries, place, last_err)
 
 #def geocode(city: str, state: Optional[str]) -> Tuple[float, float, str]:
 #    q = f"{city},{state}" if state else city
@@ -134,19 +357,123 @@ WMO = {
     95:"Thunderstorm",96:"Thunderstorm w/ hail",99:"Thunderstorm w/ heavy hail"
 }
 
-def fetch_forecast(lat: float, lon: float, tzname: str):
-    r = requests.get(
-        "https://api.open-meteo.com/v1/forecast",
-        params={
-            "latitude": lat,
-            "longitude": lon,
-            "daily": "weathercode,temperature_2m_max,temperature_2m_min,precipitation_probability_max",
-            "timezone": tzname
-        },
-        timeout=15
-    )
-    r.raise_for_status()
-    return r.json()
+def _field_params(hourly: bool) -> dict:
+    # daily series always; hourly series (7 days x 24h) only for the "hourly" detail level
+    return {"daily": DAILY_FIELDS, "hourly": HOURLY_FIELDS} if hourly else {"daily": DAILY_FIELDS}
+
+def _provider(name: str):
+    urls = {"open-meteo": FORECAST_URL, "wttr": WTTR_URL}
+    if name not in PROVIDERS:
+        raise ValueError(f"unknown forecast provider {name!r} (known: {', '.join(PROVIDERS)})")
+    return PROVIDERS[name](urls[name], timeout=PROVIDER_TIMEOUT)
+
+_hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="forecast-hedge")
+_forecaster = Hedger([_provider(n) for n in FORECAST_PROVIDERS], _hedge_pool, HEDGE_MIN_DELAY, HEDGE_MAX_DELAY)
+
+def fetch_forecast(lat: float, lon: float, tzname: str, hourly: bool = False):
+    # normalized forecast from the first provider to answer (see providers.Hedger)
+    data = _forecaster.fetch(lat, lon, tzname, hourly)
+    _archive_forecast(lat, lon, tzname, data)
+    return data
+
+_refresh_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="forecast-refresh")
+def _from_fallback(data: Optional[dict]) -> bool:
+    # e.g. wttr.in's 3 days standing in for Open-Meteo's 7 while the primary is slow or down
+    return bool(data) and data.get("provider", FORECAST_PROVIDERS[0]) != FORECAST_PROVIDERS[0]
+
+def _forecast_ttl(data) -> Optional[float]:
+    # a fallback answer is only cached briefly, so the next request gives the primary another try
+    return FALLBACK_CACHE_TTL if _from_fallback(data) else None
+
+_forecasts = ForecastCache(_refresh_pool, FORECAST_CADENCE, FORECAST_PUBLISH_LAG, FORECAST_MAX_STALE, FORECAST_CACHE_MAX,
+                           ttl_for=_forecast_ttl)
+
+def _forecast_key(lat: float, lon: float, tzname: str, hourly: bool = False) -> tuple:
+    return round(lat, 4), round(lon, 4), tzname, DAILY_FIELDS + ("|" + HOURLY_FIELDS if hourly else "")
+
+def get_forecast(lat: float, lon: float, tzname: str, hourly: bool = False):
+    # cached fetch_forecast(); concurrent callers for one location share a single upstream call
+    return _forecasts.get(_forecast_key(lat, lon, tzname, hourly), lambda: fetch_forecast(lat, lon, tzname, hourly))
+
+# ------------ Forecast archive ------------
+_archive = ForecastArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
+# one writer: appends stay in fetch order and off the request path
+_archive_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="archive")
+
+def _archive_forecast(lat: float, lon: float, tzname: str, data: Optional[dict]):
+    # only upstream fetches are archived; cache hits would just repeat the last rows. Only the primary
+    # provider's, too: mixing in a fallback's (shorter, differently modelled) rows would skew /history
+    if _archive is not None and data and not _from_fallback(data):
+        _archive_pool.submit(_archive.record, lat, lon, tzname, data, time.time())
+
+# ------------ Batched forecasts ------------
+Location = Tuple[float, float, str]   # (lat, lon, tzname)
+_batch_pool = ThreadPoolExecutor(max_workers=FORECAST_BATCH_WORKERS, thread_name_prefix="forecast-batch")
+
+def _fetch_chunk(chunk: List[Location], hourly: bool = False) -> List[dict]:
+    # Open-Meteo takes comma-separated coordinate/timezone lists and answers with an array
+    with tracing.span("http.forecast_batch", locations=len(chunk), hourly=hourly) as sp:
+        r = requests.get(
+            FORECAST_URL,
+            params={
+                "latitude": ",".join(str(lat) for lat, _, _ in chunk),
+                "longitude": ",".join(str(lon) for _, lon, _ in chunk),
+                **_field_params(hourly),
+                "timezone": ",".join(tz for _, _, tz in chunk),
+            },
+            headers=tracing.inject(),
+            timeout=30
+        )
+        sp.set(status=r.status_code)
+        r.raise_for_status()
+        data = r.json()
+    if isinstance(data, dict):
+        data = [data]
+    if len(data) != len(chunk):
+        raise RuntimeError(f"forecast batch returned {len(data)} results for {len(chunk)} locations")
+    return [dict(d, provider="open-meteo") for d in data]
+
+def fetch_forecast_batch(locations: List[Location], hourly: bool = False) -> List[Optional[dict]]:
+    """
+    Fetch many locations in FORECAST_BATCH_SIZE chunks, chunks in parallel.
+    Returns one result per input, in order; duplicates are fetched once and
+    locations whose chunk failed come back as None.
+    """
+    uniq = list(dict.fromkeys((round(lat, 4), round(lon, 4), tz) for lat, lon, tz in locations))
+    chunks = [uniq[i:i + FORECAST_BATCH_SIZE] for i in range(0, len(uniq), FORECAST_BATCH_SIZE)]
+    futures = [_batch_pool.submit(tracing.bind(_fetch_chunk), c, hourly) for c in chunks]
+    by_loc = {}
+    for chunk, fut in zip(chunks, futures):
+        try:
+            results = fut.result()
+        except Exception as e:
+            print(f"[forecast] batch of {len(chunk)} failed: {e}")
+            continue
+        for (lat, lon, tz), data in zip(chunk, results):
+            by_loc[(lat, lon, tz)] = data
+            _archive_forecast(lat, lon, tz, data)
+    return [by_loc.get((round(lat, 4), round(lon, 4), tz)) for lat, lon, tz in locations]
+
+def get_forecasts(locations: List[Location], hourly: bool = False) -> List[Optional[dict]]:
+    # cache-aware fetch_forecast_batch(): only missing entries go upstream, stale ones refresh individually
+    out: List[Optional[dict]] = []
+    missing = []
+    for i, (lat, lon, tz) in enumerate(locations):
+        key = _forecast_key(lat, lon, tz, hourly)
+        value, state = _forecasts.peek(key, record=True)
+        if state == "stale":
+            _forecasts.refresh(key, lambda lat=lat, lon=lon, tz=tz: fetch_forecast(lat, lon, tz, hourly))
+        elif state == "miss":
+            missing.append(i)
+        out.append(value)
+    if missing:
+        fetched = fetch_forecast_batch([locations[i] for i in missing], hourly)
+        for i, data in zip(missing, fetched):
+            if data is not None:
+                lat, lon, tz = locations[i]
+                _forecasts.put(_forecast_key(lat, lon, tz, hourly), data)
+            out[i] = data
+    return out
 
 def format_message(city_label: str, tzname: str, daily: dict) -> str:
     code = int(daily["weathercode"][0])
@@ -154,12 +481,84 @@ def format_message(city_label: str, tzname: str, daily: dict) -> str:
     lo = round(float(daily["temperature_2m_min"][0]))
     precip = int(daily.get("precipitation_probability_max", [0])[0] or 0)
     desc = WMO.get(code, f"Code {code}")
-    today = tznow().strftime("%A, %b %d")
+    today = datetime.now(pytz.timezone(tzname)).strftime("%A, %b %d")
     return (
         f"Good morning! {city_label} forecast for {today}\n"
         f"{desc}\nHigh {hi}° / Low {lo}°   •   💧 {precip}%"
     )
 
+def _hour(times: List[str], i: int) -> str:
+    # "2026-10-19T14:00" -> "2pm"
+    try:
+        return datetime.fromisoformat(times[i]).strftime("%-I%p").lower()
+    except (IndexError, ValueError):
+        return f"+{i}h"
+
+def format_detail(city_label: str, tzname: str, data: dict, summary: dict) -> str:
+    # brief message plus today's hourly highlights from analytics.analyze_hourly
+    lines = [format_message(city_label, tzname, data["daily"])]
+    times = (data.get("hourly") or {}).get("time") or []
+    for w in summary["rain_windows"][:3]:
+        lines.append(f"🌧 Rain likely {_hour(times, w['start'])}–{_hour(times, w['end'])} (up to {w['peak']}%)")
+    if not summary["rain_windows"]:
+        lines.append(f"☂️ No rain window above {RAIN_THRESHOLD:g}% today")
+    pt = summary["peak_temp"]
+    if pt["value"] is not None:
+        lines.append(f"🌡 Peak {round(pt['value'])}° around {_hour(times, pt['hour'])}")
+    uv = summary["peak_uv"]
+    if uv["value"] is not None and uv["value"] >= UV_THRESHOLD:
+        lines.append(f"☀️ UV {uv['value']:g} at {_hour(times, uv['hour'])}")
+    wd = summary["peak_wind"]
+    if wd["value"] is not None and wd["value"] >= WIND_THRESHOLD:
+        lines.append(f"💨 Wind up to {round(wd['value'])} km/h at {_hour(times, wd['hour'])}")
+    return "\n".join(lines)
+
+def format_digest(city_label: str, tzname: str, daily: dict, summary: dict) -> str:
+    # multi-day outlook from analytics.analyze_daily
+    today = datetime.now(pytz.timezone(tzname)).strftime("%A, %b %d")
+    lines = [f"{city_label} — {len(daily.get('time') or [])}-day outlook from {today}"]
+    for i, day in enumerate(daily.get("time") or []):
+        code = int(daily["weathercode"][i] or 0)
+        hi = round(float(daily["temperature_2m_max"][i]))
+        lo = round(float(daily["temperature_2m_min"][i]))
+        precip = int((daily.get("precipitation_probability_max") or [0] * (i + 1))[i] or 0)
+        name = datetime.fromisoformat(day).strftime("%a %d")
+        lines.append(f"{name}: {WMO.get(code, f'Code {code}')}, {hi}°/{lo}°, 💧{precip}%")
+    slope = summary["hi_trend"]
+    if slope is not None and abs(slope) >= 0.5:
+        lines.append(f"Highs trending {'up' if slope > 0 else 'down'} ~{abs(slope):.1f}°/day")
+    if summary["wettest_day"] >= 0 and (summary["wettest_prob"] or 0) >= RAIN_THRESHOLD:
+        wet = datetime.fromisoformat(daily["time"][summary["wettest_day"]]).strftime("%A")
+        lines.append(f"Wettest: {wet} ({summary['wettest_prob']:g}%)")
+    return "\n".join(lines)
+
+def render_messages(items: List[Tuple[str, str, dict, str]]) -> List[Tuple[str, Optional[dict]]]:
+    """
+    Render (label, tzname, forecast, detail) items to (message, analysis) pairs.
+    All "hourly" items are analyzed in one vectorized pass, all "week" items in another.
+    """
+    with tracing.span("render", items=len(items)):
+        return _render(items)
+
+def _render(items: List[Tuple[str, str, dict, str]]) -> List[Tuple[str, Optional[dict]]]:
+    by_detail = {d: [i for i, it in enumerate(items) if it[3] == d] for d in DETAIL_LEVELS}
+    analysis: dict = {}
+    if by_detail["hourly"]:
+        sums = analytics.analyze_hourly([items[i][2] for i in by_detail["hourly"]], 24,
+                                        RAIN_THRESHOLD, HEAT_THRESHOLD, UV_THRESHOLD, WIND_THRESHOLD)
+        analysis.update(zip(by_detail["hourly"], sums))
+    if by_detail["week"]:
+        analysis.update(zip(by_detail["week"], analytics.analyze_daily([items[i][2] for i in by_detail["week"]])))
+    out = []
+    for i, (label, tzname, data, detail) in enumerate(items):
+        if detail == "hourly":
+            out.append((format_detail(label, tzname, data, analysis[i]), analysis[i]))
+        elif detail == "week":
+            out.append((format_digest(label, tzname, data["daily"], analysis[i]), analysis[i]))
+        else:
+            out.append((format_message(label, tzname, data["daily"]), None))
+    return out
+
 #def notify(msg: str):
 #    if not NOTIFY_URL:
 #        print("[notify] NOTIFY_URL not set — printing message:\n", msg)
@@ -171,50 +570,50 @@ def format_message(city_label: str, tzname: str, daily: dict) -> str:
 #    except Exception as e:
 #        print("[notify-error]", e)
 
-def notify(msg: str):
+def _can_notify(msg: str, to) -> bool:
+    # False means "nothing to send to" (the message is printed instead)
     if not NOTIFY_URL:
         print("[notify] NOTIFY_URL not set — printing message:\n", msg)
-        return
-    if not NOTIFY_TO:
+        return False
+    if not to:
         print("[notify] NOTIFY_TO not set — gateway requires a recipient. Printing message:\n", msg)
-        return
+        return False
+    return True
 
-    # Try common payloads your gateway may accept
-    attempts = []
+def _idem_key(*parts) -> str:
+    return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
 
-    # A) Preferred: Authorization header, minimal body
-    headers = {"Authorization": f"Bearer {NOTIFY_TOKEN}"} if NOTIFY_TOKEN else {}
-    attempts.append( ({"to": NOTIFY_TO, "message": msg}, headers) )
-
-    # B) Fallback: include token in body
-    if NOTIFY_TOKEN:
-        attempts.append( ({"to": NOTIFY_TO, "message": msg, "token": NOTIFY_TOKEN}, {}) )
-
-    last_err = None
-    for body, headers in attempts:
-        try:
-            r = requests.post(NOTIFY_URL, json=body, headers=headers, timeout=15)
-            if 200 <= r.status_code < 300:
-                print(f"[notify] {r.status_code} OK")
-                return
-            last_err = f"{r.status_code} {r.text[:160]!r}"
-        except Exception as e:
-            last_err = str(e)
-
-    print("[notify] delivery failed:", last_err)
-    print("[notify] payload tried:", body)
+def notify(msg: str, to=None, key: Optional[str] = None):
+    """
+    Queue `msg` for durable delivery to `to` (a recipient or list; gateway /send takes both,
+    default NOTIFY_TO). `key` makes the send idempotent — scheduled runs derive it from the
+    fire time so a restart can't queue the same morning message twice.
+    """
+    to = to or NOTIFY_TO
+    if not _can_notify(msg, to):
+        return
+    key = key or _idem_key(to, msg, uuid.uuid4().hex)
+    if _outbox.enqueue(to, msg, key, traceparent=tracing.current_traceparent()):
+        print(f"[notify] queued {key[:12]} for {to}")
+    else:
+        print(f"[notify] {key[:12]} already queued — skipping duplicate")
 
+def _result(label: str, data: dict, detail: str) -> dict:
+    daily = data.get("daily", {})
+    if not daily:
+        raise RuntimeError("No daily forecast returned")
+    msg, analysis = render_messages([(label, TZ, data, detail)])[0]
+    out = {"city": label, "message": msg, "raw": daily}
+    if analysis is not None:
+        out["analysis"] = analysis
+    return out
 
-def run_once(city: Optional[str]=None, state: Optional[str]=None) -> dict:
+def run_once(city: Optional[str]=None, state: Optional[str]=None, detail: str = "brief") -> dict:
     c = (city or CITY).strip()
     s = (state or STATE).strip() if (state or STATE) else None
     lat, lon, label = geocode(c, s)
-    data = fetch_forecast(lat, lon, TZ)
-    daily = data.get("daily", {})
-    if not daily:
-        raise RuntimeError("No daily forecast returned")
-    msg = format_message(label, TZ, daily)
-    return {"city": label, "message": msg, "raw": daily}
+    data = get_forecast(lat, lon, TZ, hourly=detail == "hourly")
+    return _result(label, data, detail)
 
 #def run_once(city: Optional[str]=None, state: Optional[str]=None) -> dict:
 #    c = (city or CITY).strip()
@@ -227,49 +626,570 @@ def run_once(city: Optional[str]=None, state: Optional[str]=None) -> dict:
 #    msg = format_message(label, TZ, daily)
 #    return {"city": label, "message": msg, "raw": daily}
 
-# ------------ Scheduler thread ------------
-def scheduler_loop():
-    print(f"[sched] cron='{CRON}' tz='{TZ}' (source={SOURCE_NAME})")
-    # fire once on boot
+# ------------ Async request path ------------
+# Same steps as geocode/get_forecast/run_once, on one shared keep-alive httpx client, so
+# /today doesn't hold a threadpool slot while waiting on upstreams. The sync versions above stay
+# for the scheduler and the batch/fan-out paths, which run on worker threads.
+_aclient: Optional[httpx.AsyncClient] = None
+_ainflight: dict = {}  # forecast key -> asyncio.Task, single-flight for async cache misses
+
+def _http() -> httpx.AsyncClient:
+    global _aclient
+    if _aclient is None:
+        _aclient = httpx.AsyncClient(
+            timeout=15,
+            limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+        )
+    return _aclient
+
+async def _ageocode_one(q: str, fallback_label: str) -> Optional[Tuple[float, float, str]]:
+    with tracing.span("http.geocode", q=q) as sp:
+        r = await _http().get(GEOCODE_URL, params={"name": q, "count": 1}, headers=tracing.inject(), timeout=10)
+        sp.set(status=r.status_code)
+        r.raise_for_status()
+        return _parse_geocode(r.json(), fallback_label)
+
+async def _arace_queries(queries: List[str], fallback_label: str) -> Tuple[Optional[Tuple[float, float, str]], Optional[str]]:
+    # async twin of _race_queries; here losing variants are really cancelled, in flight or not
+    tasks: List[asyncio.Task] = []
+    head, last_err = 0, None
     try:
-        out = run_once()
-        notify(out["message"])
+        while head < len(queries):
+            if head == len(tasks):
+                tasks.append(asyncio.create_task(_ageocode_one(queries[head], fallback_label)))
+            running = [t for t in tasks[head:] if not t.done()]
+            if running:
+                done, _ = await asyncio.wait(running, timeout=GEOCODE_HEDGE_DELAY, return_when=asyncio.FIRST_COMPLETED)
+                if not done and len(tasks) < len(queries):
+                    tasks.append(asyncio.create_task(_ageocode_one(queries[len(tasks)], fallback_label)))
+            while head < len(tasks) and tasks[head].done():
+                try:
+                    place = tasks[head].result()
+                except Exception as e:
+                    place, last_err = None, str(e)
+                if place:
+                    return place, last_err
+                head += 1
+    finally:
+        for t in tasks:
+            t.cancel()
+    return None, last_err
+
+async def geocode_async(city: str, state: Optional[str]) -> Tuple[float, float, str]:
+    with tracing.span("geocode", city=city, state=state) as sp:
+        key, place = _geocode_local(city, state)
+        if place:
+            sp.set(source="local")
+            return place
+        queries = _geocode_queries(city, state)
+        place, last_err = await _arace_queries(queries, city.strip())
+        sp.set(source="network")
+        # settling writes the geocode cache; like notify_async, keep that off the event loop
+        return await asyncio.to_thread(_geocode_settle, city, state, key, queries, place, last_err)
+
+async def fetch_forecast_async(lat: float, lon: float, tzname: str, hourly: bool = False):
+    data = await _forecaster.afetch(_http(), lat, lon, tzname, hourly)
+    _archive_forecast(lat, lon, tzname, data)
+    return data
+
+async def get_forecast_async(lat: float, lon: float, tzname: str, hourly: bool = False):
+    key = _forecast_key(lat, lon, tzname, hourly)
+    value, state = _forecasts.peek(key, record=True)
+    if state == "fresh":
+        return value
+    if state == "stale":
+        _forecasts.refresh(key, lambda: fetch_forecast(lat, lon, tzname, hourly))
+        return value
+    task = _ainflight.get(key)
+    if task is None:
+        async def load():
+            try:
+                data = await fetch_forecast_async(lat, lon, tzname, hourly)
+                _forecasts.put(key, data)
+                return data
+            finally:
+                _ainflight.pop(key, None)
+        task = _ainflight[key] = asyncio.create_task(load())
+    return await asyncio.shield(task)
+
+async def notify_async(msg: str, to=None, key: Optional[str] = None):
+    # the outbox write is a quick local SQLite insert; keep it off the event loop anyway
+    await asyncio.to_thread(notify, msg, to, key)
+
+async def run_once_async(city: Optional[str]=None, state: Optional[str]=None, detail: str = "brief") -> dict:
+    c = (city or CITY).strip()
+    s = (state or STATE).strip() if (state or STATE) else None
+    lat, lon, label = await geocode_async(c, s)
+    data = await get_forecast_async(lat, lon, TZ, hourly=detail == "hourly")
+    return _result(label, data, detail)
+
+# ------------ Delivery ------------
+_outbox = DeliveryQueue(OUTBOX_DB, NOTIFY_URL or "", NOTIFY_TOKEN, DELIVERY_DEADLINE, DELIVERY_MAX_BACKOFF)
+
+# ------------ Subscribers ------------
+_subscribers = SubscriberRegistry(SUBSCRIBERS_DB)
+
+Send = Tuple[str, object, Optional[str]]   # (message, to, idempotency key)
+
+def _geocode_places(subs: List[dict]) -> dict:
+    # each distinct (city, state) once; failures are logged and left out
+    places = {}
+    for key in dict.fromkeys((sub["city"], sub["state"]) for sub in subs):
+        try:
+            places[key] = geocode(*key)
+        except Exception as e:
+            print(f"[subs] geocode {key} failed: {e}")
+    return places
+
+def prepare_subscribers(subs: List[dict], fire_at: Optional[datetime] = None) -> List[Send]:
+    """
+    Build the sends for a set of subscribers due together: each distinct (city, state)
+    is geocoded once, each resolved (lat, lon, tz) is fetched once (batched) and
+    rendered once per detail level, addressed to all of that place's recipients.
+    With `fire_at`, sends are keyed on it so a slot is delivered once.
+    """
+    return [send for _, send in _prepare_parts(subs, fire_at)]
+
+def _prepare_parts(subs: List[dict], fire_at: Optional[datetime] = None) -> List[Tuple[tuple, Send]]:
+    # prepare_subscribers(), each send paired with the _fingerprint() of the subscribers it covers
+    places = _geocode_places(subs)
+    groups = {}  # (lat, lon, tz) -> (label, {detail: [subscribers]})
+    for sub in subs:
+        place = places.get((sub["city"], sub["state"]))
+        if place is None:
+            continue
+        lat, lon, label = place
+        by_detail = groups.setdefault((lat, lon, sub["tz"]), (label, {}))[1]
+        by_detail.setdefault(sub.get("detail") or "brief", []).append(sub)
+
+    # places with an "hourly" subscriber need the hourly series; the rest fetch daily only
+    locs = list(groups)
+    need_hourly = [loc for loc in locs if "hourly" in groups[loc][1]]
+    daily_only = [loc for loc in locs if "hourly" not in groups[loc][1]]
+    fetched = dict(zip(need_hourly, get_forecasts(need_hourly, hourly=True)))
+    fetched.update(zip(daily_only, get_forecasts(daily_only)))
+
+    items, targets = [], []
+    for loc in locs:
+        label, by_detail = groups[loc]
+        data = fetched.get(loc)
+        if not (data or {}).get("daily"):
+            print(f"[subs] no forecast for {label}; {sum(map(len, by_detail.values()))} recipient(s) skipped")
+            continue
+        for detail, members in by_detail.items():
+            items.append((label, loc[2], data, detail))
+            targets.append(members)
+    parts = []
+    for (msg, _), members, (label, tz, _, detail) in zip(render_messages(items), targets, items):
+        recipients = list(dict.fromkeys(sub["recipient"] for sub in members))
+        key = _idem_key("subs", fire_at.isoformat(), label, tz, detail, sorted(recipients)) if fire_at else None
+        parts.append((_fingerprint(members), (msg, recipients if len(recipients) > 1 else recipients[0], key)))
+    print(f"[subs] prepared {len(parts)} message(s) for {len(subs)} subscriber(s) across {len(groups)} location(s)")
+    return parts
+
+def fire_subscribers(subs: List[dict], fire_at: Optional[datetime] = None):
+    for msg, to, key in prepare_subscribers(subs, fire_at):
+        notify(msg, to=to, key=key)
+
+# ------------ Watch mode ------------
+_watcher = Watcher(WATCH_PATH, WATCH_DAYS, ALERT_SEVERITY_JUMP, ALERT_PRECIP_JUMP)
+_watcher.load()
+atexit.register(_watcher.save)
+
+def format_alert(city_label: str, changes: List[dict]) -> str:
+    lines = [f"⚠️ Forecast update for {city_label}"]
+    for c in changes:
+        day = datetime.fromisoformat(c["day"]).strftime("%a %d")
+        if c["kind"] == "precip":
+            lines.append(f"{day}: 💧 rain chance {c['old']:g}% → {c['new']:g}%")
+        else:
+            now, was = (WMO.get(c[k], f"Code {c[k]}") for k in ("new", "old"))
+            lines.append(f"{day}: {'⛈ ' if c['kind'] == 'thunder' else ''}now {now} (was {was})")
+    return "\n".join(lines)
+
+def watch_once() -> dict:
+    """
+    One watch pass: fetch (through the forecast cache) every place an alerts subscriber
+    watches and diff it against the last snapshot. Only places whose forecast crossed a
+    threshold get a message; unchanged ones cost a comparison.
+    """
+    subs = _subscribers.list(enabled_only=True, alerts_only=True)
+    places = _geocode_places(subs)
+    groups = {}  # (lat, lon, tz) -> (label, [recipients])
+    for sub in subs:
+        place = places.get((sub["city"], sub["state"]))
+        if place is not None:
+            groups.setdefault((place[0], place[1], sub["tz"]), (place[2], []))[1].append(sub["recipient"])
+    locs = list(groups)
+    alerts = 0
+    for loc, data in zip(locs, get_forecasts(locs)):
+        if not (data or {}).get("daily"):
+            continue
+        changes = _watcher.observe(loc, data)
+        if not changes:
+            continue
+        label, recipients = groups[loc]
+        recipients = list(dict.fromkeys(recipients))
+        # keyed on the change itself, so the same change is never alerted twice
+        key = _idem_key("alert", loc, sorted(recipients), changes)
+        notify(format_alert(label, changes), to=recipients if len(recipients) > 1 else recipients[0], key=key)
+        alerts += 1
+    if len(places) == len({(sub["city"], sub["state"]) for sub in subs}):
+        _watcher.forget(locs)   # only when every place resolved, so a geocode blip doesn't reset baselines
+    _watcher.save()
+    return {"subscribers": len(subs), "locations": len(locs), "alerts": alerts}
+
+# ------------ Pre-warm ------------
+# PREWARM_LEAD seconds before a fire the scheduler calls the job's prewarm hook, which does the
+# geocode/fetch/render and parks the sends here; the fire then only enqueues them. Each send is
+# parked with the subscribers it covers, so a fire uses the sends whose subscribers are all due
+# and unchanged, and computes inline only for the rest (prewarm failed, restart, edits since).
+_prepared_lock = threading.Lock()
+_prepared: dict = {}   # (job, fire timestamp) -> ([(fingerprint, send)], prepared_at)
+_prepared_stats = {"hits": 0, "partial": 0, "misses": 0}
+
+def _same_day(fire_at: datetime, tzname: Optional[str] = None) -> bool:
+    # messages are dated "today" when rendered; a prewarm before midnight would date them wrong.
+    # Judged in `tzname` if given: a batch mixes timezones, fire_at carries just one of them.
+    tz = pytz.timezone(tzname) if tzname else fire_at.tzinfo
+    return datetime.now(tz).date() == fire_at.astimezone(tz).date()
+
+def _prepared_put(key: tuple, parts: List[Tuple[tuple, Send]]):
+    now = time.time()
+    with _prepared_lock:
+        for k in [k for k, v in _prepared.items() if now - v[1] > PREWARM_LEAD + MISFIRE_GRACE]:
+            del _prepared[k]
+        _prepared[key] = (parts, now)
+
+def _prepared_take(key: tuple, subs: List[dict]) -> Tuple[List[Send], List[dict]]:
+    """
+    Parked sends for `key` whose subscribers are all in `subs` and unchanged, plus the
+    subscribers none of them covers. Parts not used stay parked for a later fire of the
+    same instant.
+    """
+    current = set(_fingerprint(subs))
+    with _prepared_lock:
+        parts, at = _prepared.pop(key, ([], None))
+        used = [p for p in parts if set(p[0]) <= current]
+        rest = [p for p in parts if not set(p[0]) <= current]
+        if rest:
+            _prepared[key] = (rest, at)
+        covered = {sid for fp, _ in used for sid, _ in fp}
+        todo = [sub for sub in subs if sub["id"] not in covered]
+        _prepared_stats["misses" if not used else "partial" if todo else "hits"] += 1
+    return [send for _, send in used], todo
+
+def _deliver(sends: List[Send]):
+    for msg, to, key in sends:
+        notify(msg, to=to, key=key)
+
+# ------------ Scheduler ------------
+_scheduler = Scheduler(SCHED_WORKERS, MISFIRE_POLICY, MISFIRE_GRACE, SCHED_JITTER, on_run=_save_state,
+                       prewarm_lead=PREWARM_LEAD)
+
+def _default_sends(fire_at: datetime) -> List[Send]:
+    return [(run_once()["message"], None, _idem_key("default", fire_at.isoformat()))]
+
+def _prewarm_default(_, fire_at: datetime):
+    if _same_day(fire_at):
+        with tracing.span("prewarm.default", fire_at=fire_at.isoformat()):
+            _prepared_put(("default", fire_at.timestamp()), [((), send) for send in _default_sends(fire_at)])
+
+def _fire_default(_, fire_at: datetime):
+    try:
+        with tracing.span("job.default", fire_at=fire_at.isoformat()) as sp:
+            sends, _ = _prepared_take(("default", fire_at.timestamp()), [])
+            sp.set(prewarmed=bool(sends))
+            _deliver(sends or _default_sends(fire_at))
     except Exception as e:
-        print("[sched] initial run failed:", e)
-    # compute next
-    nxt = next_run(tznow(), CRON)
-    print(f"[sched] next run at {nxt.isoformat()}")
+        print("[sched] run failed:", e)
+    with _state_lock:
+        _state["last_run"] = tznow().isoformat()
+
+def _due_subscribers(sids: List[int]) -> List[dict]:
+    return [sub for sub in (_subscribers.get(sid) for sid in sids) if sub and sub["enabled"]]
+
+def _fingerprint(subs: List[dict]) -> tuple:
+    # prepared sends are only reused if none of these rows changed in between
+    return tuple(sorted((sub["id"], sub["updated_at"]) for sub in subs))
+
+def _prewarm_subscriber_batch(sids: List[int], fire_at: datetime):
+    # each subscriber's own local day; the rest are rendered at the fire
+    subs = [sub for sub in _due_subscribers(sids) if _same_day(fire_at, sub["tz"])]
+    if subs:
+        with tracing.span("prewarm.subscribers", fire_at=fire_at.isoformat(), subscribers=len(subs)):
+            _prepared_put(("subs", fire_at.timestamp()), _prepare_parts(subs, fire_at))
+
+def _fire_subscriber_batch(sids: List[int], fire_at: datetime):
+    # one call for every subscriber due at this instant, so prepare_subscribers can group by place
+    subs = _due_subscribers(sids)
+    if not subs:
+        return
+    with tracing.span("job.subscribers", fire_at=fire_at.isoformat(), subscribers=len(subs)) as sp:
+        sends, todo = _prepared_take(("subs", fire_at.timestamp()), subs)
+        sp.set(prewarmed=len(subs) - len(todo))
+        _deliver(sends + (prepare_subscribers(todo, fire_at) if todo else []))
+    print(f"[subs] fired {len(subs)} subscriber(s), {len(subs) - len(todo)} prewarmed")
+
+def _fire_watch(_, fire_at: datetime):
+    with tracing.span("job.watch", fire_at=fire_at.isoformat()) as sp:
+        out = watch_once()
+        sp.set(**out)
+    if out["alerts"]:
+        print(f"[watch] {out['alerts']} alert(s) across {out['locations']} location(s)")
+
+def _saved_job(jobs: dict, job_id: str, cron: str, tz: str) -> dict:
+    # a snapshot entry only applies if the job's schedule hasn't changed since
+    saved = jobs.get(job_id) or {}
+    return saved if (saved.get("cron"), saved.get("tz")) == (cron, tz) else {}
+
+def _schedule_subscriber(sub: dict, jobs: Optional[dict] = None):
+    job_id = f"sub:{sub['id']}"
+    if not sub["enabled"]:
+        _scheduler.remove_job(job_id)
+        return
+    saved = _saved_job(jobs or {}, job_id, sub["cron"], sub["tz"])
+    _scheduler.add_job(job_id, sub["cron"], sub["tz"], _fire_subscriber_batch, sub["id"], batch=True,
+                       next_fire=saved.get("next"), last_fired=saved.get("last"), prewarm=_prewarm_subscriber_batch)
+
+def _snapshot_loop():
     while True:
-        now = tznow()
-        if now >= nxt:
-            try:
-                out = run_once()
-                notify(out["message"])
-            except Exception as e:
-                print("[sched] run failed:", e)
-            nxt = next_run(tznow(), CRON)
-            print(f"[sched] next run at {nxt.isoformat()}")
-        time.sleep(1)
+        time.sleep(SNAPSHOT_INTERVAL)
+        _save_state()
+        _geocache.save()   # no-op unless something was cached since the last flush
+
+def start_scheduler():
+    print(f"[sched] cron='{CRON}' tz='{TZ}' policy={MISFIRE_POLICY} (source={SOURCE_NAME})")
+    snap = _restore_state()
+    jobs = snap.get("jobs") or {}
+    default = _saved_job(jobs, "default", CRON, TZ)
+    if not snap:
+        # no snapshot: fire once on boot, as a fresh install always has
+        default = {"next": time.time()}
+    _scheduler.add_job("default", CRON, TZ, _fire_default,
+                       next_fire=default.get("next"), last_fired=default.get("last"), prewarm=_prewarm_default)
+    subs = _subscribers.list(enabled_only=True)
+    for sub in subs:
+        _schedule_subscriber(sub, jobs)
+    if WATCH_CRON:
+        watch = _saved_job(jobs, "watch", WATCH_CRON, TZ)
+        _scheduler.add_job("watch", WATCH_CRON, TZ, _fire_watch,
+                           next_fire=watch.get("next"), last_fired=watch.get("last"))
+    _scheduler.start()
+    _save_state()
+    threading.Thread(target=_snapshot_loop, name="snapshot", daemon=True).start()
+    print(f"[sched] next run at {_job_next_iso('default')}; {len(subs)} subscriber job(s)")
+
+def _job_next_iso(job_id: str) -> Optional[str]:
+    job = _scheduler.get_job(job_id)
+    if job is None or job.next_fire is None:
+        return None
+    return datetime.fromtimestamp(job.next_fire, job.tz).isoformat()
 
 # ------------ FastAPI app ------------
-app = FastAPI(title="weather-service", version="1.0.0")
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    yield
+    global _aclient
+    if _aclient is not None:
+        await _aclient.aclose()
+        _aclient = None
+
+app = FastAPI(title="weather-service", version="1.0.0", lifespan=lifespan)
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # every request is a span, continuing the caller's trace if it sent a traceparent
+    if request.url.path in ("/health", "/debug/traces"):
+        return await call_next(request)
+    with tracing.span(f"{request.method} {request.url.path}", parent=request.headers.get("traceparent")) as sp:
+        response = await call_next(request)
+        sp.set(status=response.status_code)
+        response.headers["traceparent"] = sp.traceparent
+        return response
 
 @app.get("/health")
 def health():
-    return {"ok": True, "tz": TZ, "cron": CRON, "city": CITY, "state": STATE, "notify_url": bool(NOTIFY_URL)}
+    with _state_lock:
+        last_run = _state["last_run"]
+    nxt = _job_next_iso("default")
+    return {"ok": True, "tz": TZ, "cron": CRON, "city": CITY, "state": STATE, "notify_url": bool(NOTIFY_URL),
+            "last_run": last_run, "next_run": nxt, "geocache": _geocache.stats(),
+            "gazetteer": len(_gazetteer) if _gazetteer else 0, "forecast_cache": _forecasts.stats(),
+            "providers": _forecaster.stats(),
+            "scheduler": _scheduler.stats(), "outbox": _outbox.stats(),
+            "prewarm": dict(_prepared_stats, pending=len(_prepared)), "watch": _watcher.stats(),
+            "archive": _archive.stats() if _archive is not None else None}
+
+class ForecastLocation(BaseModel):
+    lat: float
+    lon: float
+    tz: str = TZ
+
+@app.post("/forecasts")
+def forecasts(locations: List[ForecastLocation]):
+    if len(locations) > FORECASTS_MAX_LOCATIONS:
+        raise HTTPException(status_code=400, detail=f"at most {FORECASTS_MAX_LOCATIONS} locations per request")
+    # one bad timezone would fail the whole upstream chunk it is batched into
+    bad = [i for i, l in enumerate(locations) if l.tz not in pytz.all_timezones_set]
+    if bad:
+        raise HTTPException(status_code=400, detail=f"unknown timezone at index {', '.join(map(str, bad))}: "
+                                                    f"{locations[bad[0]].tz!r}")
+    locs = [(l.lat, l.lon, l.tz) for l in locations]
+    return [{"lat": lat, "lon": lon, "tz": tz, "forecast": data}
+            for (lat, lon, tz), data in zip(locs, get_forecasts(locs))]
+
+class SubscriberIn(BaseModel):
+    city: str
+    recipient: str
+    state: Optional[str] = None
+    name: Optional[str] = None
+    tz: str = TZ
+    cron: str = CRON
+    detail: str = "brief"
+    enabled: bool = True
+    alerts: bool = False
+
+class SubscriberPatch(BaseModel):
+    city: Optional[str] = None
+    recipient: Optional[str] = None
+    state: Optional[str] = None
+    name: Optional[str] = None
+    tz: Optional[str] = None
+    cron: Optional[str] = None
+    detail: Optional[str] = None
+    enabled: Optional[bool] = None
+    alerts: Optional[bool] = None
+
+@app.get("/subscribers")
+def list_subscribers():
+    return _subscribers.list()
+
+@app.post("/subscribers", status_code=201)
+def create_subscriber(sub: SubscriberIn):
+    try:
+        created = _subscribers.create(sub.model_dump())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    _schedule_subscriber(created)
+    return created
+
+@app.get("/subscribers/{sid}")
+def get_subscriber(sid: int):
+    sub = _subscribers.get(sid)
+    if sub is None:
+        raise HTTPException(status_code=404, detail="subscriber not found")
+    return sub
+
+@app.put("/subscribers/{sid}")
+def update_subscriber(sid: int, changes: SubscriberPatch):
+    try:
+        sub = _subscribers.update(sid, changes.model_dump(exclude_unset=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if sub is None:
+        raise HTTPException(status_code=404, detail="subscriber not found")
+    _schedule_subscriber(sub)
+    return sub
+
+@app.delete("/subscribers/{sid}")
+def delete_subscriber(sid: int):
+    if not _subscribers.delete(sid):
+        raise HTTPException(status_code=404, detail="subscriber not found")
+    _scheduler.remove_job(f"sub:{sid}")
+    return {"ok": True, "id": sid}
+
+def _trace_peers() -> List[str]:
+    if TRACE_PEERS:
+        return TRACE_PEERS
+    if NOTIFY_URL:
+        u = urlsplit(NOTIFY_URL)
+        return [f"{u.scheme}://{u.netloc}"]
+    return []
+
+@app.get("/debug/traces")
+def debug_traces(trace_id: Optional[str] = Query(None), limit: int = Query(20, ge=1, le=200)):
+    """
+    Recent traces with per-span timing (offset from the trace start, duration).
+    With trace_id, spans the gateway recorded for the same trace are merged in, so
+    one answer covers job -> outbox -> gateway -> signal-api.
+    """
+    spans = tracing.recent(trace_id, limit)
+    if not trace_id:
+        return spans
+    merged = [s for t in spans for s in t["spans"]]
+    for peer in _trace_peers():
+        try:
+            r = requests.get(f"{peer}/debug/traces", params={"trace_id": trace_id}, timeout=3)
+            r.raise_for_status()
+            merged += [s for t in r.json() for s in t["spans"]]
+        except Exception as e:
+            print(f"[trace] peer {peer} unavailable: {e}")
+    return tracing.traces(merged, limit)
+
+@app.get("/history")
+def history(city: Optional[str] = Query(None), state: Optional[str] = Query(None),
+            lat: Optional[float] = Query(None), lon: Optional[float] = Query(None),
+            start: Optional[date] = Query(None), end: Optional[date] = Query(None),
+            lead: int = Query(0, ge=0, le=16), agg: Optional[str] = Query(None),
+            accuracy: Optional[int] = Query(None, ge=1, le=16), tz: Optional[str] = Query(None)):
+    """
+    Archived daily forecasts for one place (city/state, or lat/lon) over [start, end],
+    by default the last 30 days, as fetched in `tz` (default TZ). Each day shows the last forecast made at least `lead`
+    days ahead. agg=min,max,mean,sum,count adds aggregates over the range. accuracy=N
+    compares the N-days-ahead forecasts with the final ones.
+    """
+    if _archive is None:
+        raise HTTPException(404, "forecast archive is disabled (ARCHIVE_DIR)")
+    aggs = [a.strip() for a in (agg or "").split(",") if a.strip()]
+    if any(a not in AGGREGATES for a in aggs):
+        raise HTTPException(400, f"agg must be among {', '.join(AGGREGATES)}")
+    if (lat is None) != (lon is None):
+        raise HTTPException(400, "lat and lon go together")
+    tz = tz or TZ
+    if tz not in pytz.all_timezones_set:
+        raise HTTPException(400, f"unknown timezone {tz!r}")
+    if lat is None:
+        c = (city or CITY).strip()
+        s = (state or STATE).strip() if (state or STATE) else None
+        try:
+            lat, lon, label = geocode(c, s)
+        except Exception as e:
+            raise HTTPException(404, str(e))
+    else:
+        label = None
+    end = end or datetime.now(pytz.timezone(tz)).date()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(400, "start is after end")
+    series = _archive.series(lat, lon, tz, start, end, lead)
+    out = {"city": label, "lat": lat, "lon": lon, "tz": tz, "location": _archive.location(lat, lon, tz),
+           "timezones": _archive.timezones(lat, lon),
+           "start": start.isoformat(), "end": end.isoformat(), "lead": lead, "days": series}
+    if aggs:
+        out["agg"] = _archive.aggregate(series, aggs)
+    if accuracy:
+        out["accuracy"] = _archive.accuracy(lat, lon, tz, start, end, accuracy)
+    return out
+
+@app.post("/watch")
+def run_watch():
+    # one watch pass now, outside WATCH_CRON
+    return watch_once()
 
 @app.get("/today")
-def today(city: Optional[str] = Query(None), state: Optional[str] = Query(None)):
+async def today(city: Optional[str] = Query(None), state: Optional[str] = Query(None),
+                detail: str = Query("brief", pattern="^(brief|hourly|week)$")):
     try:
-        out = run_once(city, state)
+        out = await run_once_async(city, state, detail)
         return out
     except Exception as e:
         return JSONResponse({"error": str(e)}, status_code=500)
 
 def main():
-    # start scheduler in background
-    t = threading.Thread(target=scheduler_loop, daemon=True)
-    t.start()
+    # start delivery worker and scheduler in background
+    _outbox.start()
+    start_scheduler()
     # start HTTP server
     uvicorn.run(app, host="0.0.0.0", port=8789, log_level="info")
 
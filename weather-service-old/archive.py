@@ -0,0 +1,268 @@
+"""
+Append-only columnar archive of the daily forecasts fetched upstream.
+
+One directory per location and timezone (<root>/<lat>_<lon>_<tz>/, "/" in the tz
+name written as "~") holding one file per column, rows appended in fetch order:
+
+    fetched.u4   fetch time, unix seconds
+    day.u2       target date, days since 2000-01-01
+    tmax.i2      max temperature, tenths of °C      (-32768 = missing)
+    tmin.i2      min temperature, tenths of °C      (-32768 = missing)
+    precip.u1    max precipitation probability, %   (255 = missing)
+    code.u1      WMO weather code                   (255 = missing)
+
+Daily values depend on the timezone the forecast was asked in (it sets the day
+boundaries), so the same coordinates fetched in two timezones are two series.
+A row is appended only when a target day's values differ from the last row
+archived for that day, so a row holds from its fetch time until the next row
+for the same day. At 12 bytes per change, years of hourly refetches for many
+locations stay small. Queries memory-map the columns and scan them with NumPy;
+the files are only ever appended to, so readers need no lock.
+"""
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+from zoneinfo import ZoneInfo
+
+import numpy as np
+
+from snapshot import load_snapshot, save_snapshot
+
+EPOCH = date(2000, 1, 1)
+EPOCH_UNIX_DAYS = (EPOCH - date(1970, 1, 1)).days
+# name, dtype, missing-value sentinel
+COLUMNS = (("fetched", "<u4", None), ("day", "<u2", None), ("tmax", "<i2", -32768), ("tmin", "<i2", -32768),
+           ("precip", "u1", 255), ("code", "u1", 255))
+FIELDS = ("tmax", "tmin", "precip", "code")
+AGGREGATES = ("min", "max", "mean", "sum", "count")
+_MISSING = {name: missing for name, _, missing in COLUMNS}
+_SCALE = {"tmax": 10, "tmin": 10, "precip": 1, "code": 1}
+
+Values = Tuple[int, int, int, int]   # tmax, tmin, precip, code as stored
+
+
+def _encode(v, field: str) -> int:
+    if v is None:
+        return _MISSING[field]
+    try:
+        x = round(float(v) * _SCALE[field])
+    except (TypeError, ValueError):
+        return _MISSING[field]
+    lo, hi = (-32767, 32767) if field in ("tmax", "tmin") else (0, 254)
+    return min(hi, max(lo, x))
+
+
+def _decode(values: np.ndarray, field: str) -> np.ndarray:
+    out = values.astype(float) / _SCALE[field]
+    out[values == _MISSING[field]] = np.nan
+    return out
+
+
+def _json(values: np.ndarray) -> list:
+    return [None if np.isnan(v) else round(float(v), 1) for v in values]
+
+
+class ForecastArchive:
+    def __init__(self, root: str, tail_rows: int = 4096):
+        self.root = root
+        self.tail_rows = tail_rows        # rows read back to pick up where a previous process left off
+        self._lock = threading.Lock()
+        self._index_path = os.path.join(root, "locations.json")
+        self._locations: Dict[str, dict] = load_snapshot(self._index_path).get("locations") or {}
+        self._last: Dict[str, Dict[int, Values]] = {}   # key -> target day -> last archived values
+        self.counts = {"fetches": 0, "unchanged": 0, "rows": 0, "errors": 0}
+        self._migrate()
+
+    @staticmethod
+    def key(lat: float, lon: float, tzname: str) -> str:
+        return f"{round(lat, 4):.4f}_{round(lon, 4):.4f}_{tzname.replace('/', '~')}"
+
+    def _migrate(self):
+        # archives written before the key had a timezone go to the timezone they were registered with
+        moved = False
+        for old, loc in list(self._locations.items()):
+            new = self.key(loc["lat"], loc["lon"], loc.get("tz") or "UTC")
+            if old != new and new not in self._locations:
+                if os.path.isdir(os.path.join(self.root, old)):
+                    os.replace(os.path.join(self.root, old), os.path.join(self.root, new))
+                self._locations[new] = self._locations.pop(old)
+                moved = True
+        if moved:
+            save_snapshot(self._index_path, {"locations": self._locations})
+
+    def _path(self, key: str, column: str) -> str:
+        dtype = dict((n, t) for n, t, _ in COLUMNS)[column]
+        return os.path.join(self.root, key, f"{column}.{dtype.lstrip('<')}")
+
+    def _rows(self, key: str) -> int:
+        sizes = []
+        for name, dtype, _ in COLUMNS:
+            try:
+                sizes.append(os.path.getsize(self._path(key, name)) // np.dtype(dtype).itemsize)
+            except FileNotFoundError:
+                return 0
+        return min(sizes)
+
+    def _columns(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        n = self._rows(key)
+        if not n:
+            return None
+        return {name: np.memmap(self._path(key, name), dtype=dtype, mode="r", shape=(n,))
+                for name, dtype, _ in COLUMNS}
+
+    # --- writing ---
+    def _warm(self, key: str, lat: float, lon: float, tzname: str) -> Dict[int, Values]:
+        """Last archived values per target day for `key`; registers new locations."""
+        last = self._last.get(key)
+        if last is not None:
+            return last
+        last = self._last[key] = {}
+        if key not in self._locations:
+            os.makedirs(os.path.join(self.root, key), exist_ok=True)
+            self._locations[key] = {"lat": round(lat, 4), "lon": round(lon, 4), "tz": tzname, "since": time.time()}
+            save_snapshot(self._index_path, {"locations": self._locations})
+            return last
+        n = self._rows(key)
+        for name, dtype, _ in COLUMNS:
+            # a crash between column appends leaves some columns a row ahead; cut them back
+            path = self._path(key, name)
+            if os.path.exists(path) and os.path.getsize(path) > n * np.dtype(dtype).itemsize:
+                os.truncate(path, n * np.dtype(dtype).itemsize)
+        cols = self._columns(key)
+        if cols is not None:
+            tail = slice(max(0, n - self.tail_rows), n)
+            rows = zip(*(cols[f][tail].tolist() for f in ("day",) + FIELDS))
+            for day, *values in rows:
+                last[day] = tuple(values)
+        return last
+
+    def record(self, lat: float, lon: float, tzname: str, forecast: dict, fetched_at: Optional[float] = None) -> int:
+        """Archive the daily part of a normalized forecast; returns the number of rows appended."""
+        try:
+            return self._record(lat, lon, tzname, forecast, fetched_at or time.time())
+        except Exception as e:
+            with self._lock:
+                self.counts["errors"] += 1
+            print(f"[archive] record failed for {lat},{lon}: {e}")
+            return 0
+
+    def _record(self, lat: float, lon: float, tzname: str, forecast: dict, fetched_at: float) -> int:
+        daily = (forecast or {}).get("daily") or {}
+        series = [daily.get(f) or [] for f in ("temperature_2m_max", "temperature_2m_min",
+                                               "precipitation_probability_max", "weathercode")]
+        rows: List[Tuple[int, Values]] = []
+        for i, d in enumerate(daily.get("time") or []):
+            try:
+                day = (date.fromisoformat(str(d)[:10]) - EPOCH).days
+            except ValueError:
+                continue
+            if not 0 <= day < 65535:
+                continue
+            rows.append((day, tuple(_encode(s[i] if i < len(s) else None, f) for s, f in zip(series, FIELDS))))
+        key = self.key(lat, lon, tzname)
+        with self._lock:
+            last = self._warm(key, lat, lon, tzname)
+            self.counts["fetches"] += 1
+            new = [(day, values) for day, values in rows if last.get(day) != values]
+            if not new:
+                self.counts["unchanged"] += 1
+                return 0
+            columns = {"fetched": [int(fetched_at)] * len(new), "day": [day for day, _ in new]}
+            columns.update((f, [values[j] for _, values in new]) for j, f in enumerate(FIELDS))
+            for name, dtype, _ in COLUMNS:
+                with open(self._path(key, name), "ab") as fh:
+                    fh.write(np.asarray(columns[name], dtype=dtype).tobytes())
+            for day, values in new:
+                last[day] = values
+            # days the forecast no longer covers won't change again; keep the in-memory map small
+            oldest = min(day for day, _ in rows)
+            for day in [d for d in last if d < oldest]:
+                del last[day]
+            self.counts["rows"] += len(new)
+            return len(new)
+
+    # --- reading ---
+    def series(self, lat: float, lon: float, tzname: str, start: date, end: date, lead: int = 0) -> Dict[str, list]:
+        """
+        One value per target day in [start, end] of the series fetched in `tzname`:
+        the last forecast for that day fetched at least `lead` days before it. lead=0
+        is the latest forecast archived for the day, the closest the archive gets to
+        what actually happened. Days without such a forecast are left out.
+        """
+        key = self.key(lat, lon, tzname)
+        cols = self._columns(key)
+        out: Dict[str, list] = {"date": [], "fetched_at": [], **{f: [] for f in FIELDS}}
+        if cols is None:
+            return out
+        day = cols["day"]
+        lo, hi = (start - EPOCH).days, (end - EPOCH).days
+        fetched_day = (cols["fetched"].astype(np.int64) + self._utcoffset(key)) // 86400 - EPOCH_UNIX_DAYS
+        idx = np.nonzero((day >= lo) & (day <= hi) & (day.astype(np.int64) - fetched_day >= lead))[0]
+        if not len(idx):
+            return out
+        # rows are in fetch order, so a day's last occurrence is its latest forecast
+        days, first_from_end = np.unique(day[idx][::-1], return_index=True)
+        pick = idx[len(idx) - 1 - first_from_end]
+        out["date"] = [(EPOCH + timedelta(days=int(d))).isoformat() for d in days]
+        tz = self._tz(key)
+        out["fetched_at"] = [datetime.fromtimestamp(int(t), tz).isoformat(timespec="seconds")
+                             for t in cols["fetched"][pick]]
+        for f in FIELDS:
+            values = _decode(np.asarray(cols[f][pick]), f)
+            out[f] = [None if v is None else int(v) for v in _json(values)] if f == "code" else _json(values)
+        return out
+
+    @staticmethod
+    def aggregate(series: Dict[str, list], aggs: Sequence[str] = AGGREGATES,
+                  fields: Sequence[str] = ("tmax", "tmin", "precip")) -> Dict[str, dict]:
+        out = {}
+        for f in fields:
+            v = np.array([np.nan if x is None else x for x in series.get(f, [])], dtype=float)
+            ok = v[~np.isnan(v)]
+            res = {"count": int(ok.size)}
+            if ok.size:
+                res.update(min=float(ok.min()), max=float(ok.max()), mean=round(float(ok.mean()), 2),
+                           sum=round(float(ok.sum()), 1))
+            out[f] = {a: res.get(a) for a in aggs}
+        return out
+
+    def accuracy(self, lat: float, lon: float, tzname: str, start: date, end: date, lead: int) -> dict:
+        """How far the forecasts made `lead` days ahead were from the final (lead 0) ones."""
+        early = self.series(lat, lon, tzname, start, end, lead)
+        final = self.series(lat, lon, tzname, start, end, 0)
+        common, ie, i_f = np.intersect1d(early["date"], final["date"], return_indices=True)
+        out: dict = {"lead": lead, "days": int(common.size)}
+        for f in ("tmax", "tmin", "precip"):
+            e = np.array([np.nan if x is None else x for x in early[f]], dtype=float)[ie]
+            a = np.array([np.nan if x is None else x for x in final[f]], dtype=float)[i_f]
+            err = (e - a)[~np.isnan(e - a)]
+            out[f] = ({"mae": round(float(np.abs(err).mean()), 2), "bias": round(float(err.mean()), 2)}
+                      if err.size else None)
+        codes = [(early["code"][i], final["code"][j]) for i, j in zip(ie, i_f)
+                 if early["code"][i] is not None and final["code"][j] is not None]
+        out["code_match"] = round(sum(a == b for a, b in codes) / len(codes), 3) if codes else None
+        return out
+
+    def _tz(self, key: str) -> ZoneInfo:
+        try:
+            return ZoneInfo(self._locations[key]["tz"])
+        except Exception:
+            return ZoneInfo("UTC")
+
+    def _utcoffset(self, key: str) -> int:
+        # today's offset for every row: fetches in the hour a DST change moves can land a day off
+        return int(datetime.now(self._tz(key)).utcoffset().total_seconds())
+
+    def location(self, lat: float, lon: float, tzname: str) -> Optional[dict]:
+        return self._locations.get(self.key(lat, lon, tzname))
+
+    def timezones(self, lat: float, lon: float) -> List[str]:
+        """Every timezone archived for these coordinates."""
+        lat, lon = round(lat, 4), round(lon, 4)
+        return sorted(loc["tz"] for loc in self._locations.values() if (loc["lat"], loc["lon"]) == (lat, lon))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts, locations=len(self._locations))
@@ -0,0 +1,284 @@
+"""
+Benchmark weather-service against the local stand-in (bench/standin.py).
+
+  python bench/run.py --out before.json
+  python bench/run.py --out after.json --compare before.json
+
+The stand-in runs in a subprocess, everything against a fresh DATA_DIR:
+  today   GET /today over HTTP at --concurrency against the service under uvicorn
+          (another subprocess): throughput and p50/p90/p99
+  stages  geocode / fetch / format / notify timed separately in this process, all uncached
+  fanout  one scheduled fire for --subscribers subscribers across --fanout-cities places,
+          time to prepare and until the outbox has delivered every message
+
+Everything goes to the JSON file; --compare prints the change in the headline numbers.
+The load generator shares the machine with the service, so compare runs made on the
+same host, ideally with a core to spare.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import standin  # noqa: E402
+
+
+def pct(samples: List[float], q: float) -> float:
+    if not samples:
+        return float("nan")
+    s = sorted(samples)
+    return s[min(len(s) - 1, int(q * len(s)))]
+
+
+def summary(samples: List[float]) -> Dict[str, float]:
+    ms = [v * 1000 for v in samples]
+    return {"n": len(ms), "mean_ms": round(sum(ms) / len(ms), 2) if ms else None,
+            "p50_ms": round(pct(ms, 0.50), 2), "p90_ms": round(pct(ms, 0.90), 2),
+            "p99_ms": round(pct(ms, 0.99), 2), "max_ms": round(max(ms), 2) if ms else None}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def configure_env(base: str, data_dir: str, args):
+    os.environ.update({
+        "DATA_DIR": data_dir,
+        "GEOCODE_URL": f"{base}/v1/search",
+        "FORECAST_URL": f"{base}/v1/forecast",
+        "NOTIFY_URL": f"{base}/send",
+        "NOTIFY_TO": "+15550000000",
+        "FORECAST_PROVIDERS": "open-meteo",
+        "FORECAST_BATCH_SIZE": str(args.batch_size),
+        "GAZETTEER_PATH": "",          # geocode over the network so the geocode stage measures something
+        "TRACE_PATH": "",
+        "PREWARM_LEAD": "0",
+    })
+    for k in ("LAT", "LON"):
+        os.environ.pop(k, None)
+
+
+def bench_stages(app, n: int) -> dict:
+    times: Dict[str, List[float]] = {"geocode": [], "fetch": [], "format": [], "notify": []}
+    for i in range(n):
+        t0 = time.perf_counter()
+        lat, lon, label = app.geocode(f"Stagetown {i}", "FL")
+        t1 = time.perf_counter()
+        data = app.fetch_forecast(lat, lon, app.TZ, hourly=True)
+        t2 = time.perf_counter()
+        msgs = app.render_messages([(label, app.TZ, data, d) for d in app.DETAIL_LEVELS])
+        t3 = time.perf_counter()
+        app.notify(msgs[0][0], key=app._idem_key("bench-stage", i, time.time()))
+        app._outbox.drain_once()
+        t4 = time.perf_counter()
+        for k, v in zip(times, (t1 - t0, t2 - t1, t3 - t2, t4 - t3)):
+            times[k].append(v)
+    return {k: summary(v) for k, v in times.items()}
+
+
+def wait_until_up(url: str, proc: subprocess.Popen, what: str):
+    deadline = time.time() + 15
+    while True:
+        try:
+            httpx.get(url, timeout=5).raise_for_status()
+            return
+        except httpx.HTTPError:
+            if time.time() > deadline or proc.poll() is not None:
+                raise RuntimeError(f"{what} did not start")
+            time.sleep(0.05)
+
+
+class Service:
+    """
+    The service under uvicorn in its own process (own DATA_DIR), as in production;
+    sharing a GIL with the load generator would dominate the latencies measured.
+    """
+
+    def __init__(self, data_dir: str):
+        self.port = free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        code = f"import uvicorn, app; uvicorn.run(app.app, host='127.0.0.1', port={self.port}, log_level='warning')"
+        self.proc = subprocess.Popen([sys.executable, "-c", code], cwd=os.path.dirname(HERE),
+                                     env=dict(os.environ, DATA_DIR=data_dir), stdout=subprocess.DEVNULL)
+        wait_until_up(f"{self.base}/health", self.proc, "weather-service")
+
+    def health(self) -> dict:
+        return httpx.get(f"{self.base}/health", timeout=5).json()
+
+    def close(self):
+        self.proc.terminate()
+
+
+async def bench_today(base: str, requests_n: int, concurrency: int, cities: int, detail: str) -> dict:
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(requests_n))
+
+    async def worker(client: httpx.AsyncClient):
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            try:
+                r = await client.get(f"{base}/today", params={"city": f"Todayville {i % cities}", "state": "FL",
+                                                              "detail": detail})
+                ok = r.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            latencies.append(time.perf_counter() - t0)
+            errors += not ok
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - t0
+    return dict(summary(latencies), requests=requests_n, concurrency=concurrency, cities=cities, detail=detail,
+                errors=errors, elapsed_s=round(elapsed, 3), rps=round(requests_n / elapsed, 1))
+
+
+class Upstream:
+    """The stand-in in its own process, so it doesn't share a GIL with the service under test."""
+
+    def __init__(self, args):
+        self.port = free_port()
+        self.base = f"http://127.0.0.1:{self.port}"
+        flags = [f"--{k.replace('_', '-')}={getattr(args, k)}"
+                 for k in ("latency_ms", "jitter_ms", "slow_rate", "slow_ms", "error_rate", "days", "send_latency_ms")]
+        self.proc = subprocess.Popen([sys.executable, os.path.join(HERE, "standin.py"), f"--port={self.port}", *flags],
+                                     stdout=subprocess.DEVNULL)
+        wait_until_up(f"{self.base}/stats", self.proc, "stand-in")
+
+    def stats(self) -> dict:
+        return httpx.get(f"{self.base}/stats", timeout=5).json()
+
+    def reset(self):
+        httpx.post(f"{self.base}/stats/reset", timeout=5)
+
+    def close(self):
+        self.proc.terminate()
+
+
+def bench_fanout(app, server: Upstream, subscribers: int, cities: int, timeout: float) -> dict:
+    sids = []
+    for i in range(subscribers):
+        sub = app._subscribers.create({
+            "name": f"bench {i}", "city": f"Fanout City {i % cities}", "state": "FL", "tz": app.TZ,
+            "cron": "0 7 * * *", "recipient": f"+1555{i:07d}",
+            "detail": app.DETAIL_LEVELS[i % len(app.DETAIL_LEVELS)], "enabled": True,
+        })
+        sids.append(sub["id"])
+    server.reset()
+    before = app._outbox.stats().get("sent", 0)
+    fire_at = datetime.now(app._tz())
+    t0 = time.perf_counter()
+    with app.tracing.span("bench.fanout") as sp:
+        app._fire_subscriber_batch(sids, fire_at)
+    t_prepared = time.perf_counter()
+    deadline = time.time() + timeout
+    while app._outbox.stats().get("pending", 0) and time.time() < deadline:
+        time.sleep(0.005)
+    t_done = time.perf_counter()
+    stats = app._outbox.stats()
+    spans = {s["name"]: s["duration_ms"] for t in app.tracing.recent(sp.trace_id) for s in t["spans"]
+             if not s["name"].startswith("http.")}
+    return {
+        "subscribers": subscribers, "cities": cities,
+        "prepare_s": round(t_prepared - t0, 3), "deliver_s": round(t_done - t_prepared, 3),
+        "total_s": round(t_done - t0, 3), "messages_sent": stats.get("sent", 0) - before,
+        "pending_after": stats.get("pending", 0), "upstream": server.stats(), "span_ms": spans,
+    }
+
+
+def compare(current: dict, previous: dict):
+    rows = [("today rps", ("today", "rps")), ("today p50 ms", ("today", "p50_ms")),
+            ("today p99 ms", ("today", "p99_ms")), ("fanout total s", ("fanout", "total_s"))]
+    rows += [(f"{k} p50 ms", ("stages", k, "p50_ms")) for k in current.get("stages", {})]
+    print(f"{'metric':<22}{'before':>12}{'after':>12}{'change':>10}")
+    for name, path in rows:
+        a, b = previous, current
+        for k in path:
+            a, b = (a or {}).get(k), (b or {}).get(k)
+        if isinstance(a, (int, float)) and isinstance(b, (int, float)) and a:
+            print(f"{name:<22}{a:>12}{b:>12}{(b - a) / a:>+10.1%}")
+
+
+def run_all(args, upstream: Upstream, data_dir: str) -> dict:
+    results = {"started": datetime.now().isoformat(timespec="seconds"), "config": vars(args)}
+    service = Service(os.path.join(data_dir, "today"))
+    try:
+        results["today"] = asyncio.run(bench_today(service.base, args.today_requests, args.concurrency,
+                                                   args.cities, args.detail))
+        health = service.health()
+        results["today"]["service"] = {k: health.get(k) for k in ("forecast_cache", "geocache", "providers")}
+    finally:
+        service.close()
+
+    import app   # reads its config from the environment set up by configure_env()
+    results["stages"] = bench_stages(app, args.stage_iterations)
+    app._outbox.start()
+    results["fanout"] = bench_fanout(app, upstream, args.subscribers, args.fanout_cities, args.fanout_timeout)
+    results["service"] = {"forecast_cache": app._forecasts.stats(), "geocache": app._geocache.stats(),
+                          "providers": app._forecaster.stats(), "outbox": app._outbox.stats()}
+    return results
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    standin.add_arguments(ap)
+    ap.add_argument("--stage-iterations", type=int, default=50)
+    ap.add_argument("--today-requests", type=int, default=2000)
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--cities", type=int, default=50, help="distinct cities /today rotates through")
+    ap.add_argument("--detail", default="brief", choices=("brief", "hourly", "week"))
+    ap.add_argument("--subscribers", type=int, default=500)
+    ap.add_argument("--fanout-cities", type=int, default=100)
+    ap.add_argument("--fanout-timeout", type=float, default=300)
+    ap.add_argument("--batch-size", type=int, default=50, help="FORECAST_BATCH_SIZE")
+    ap.add_argument("--out", default=f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    ap.add_argument("--compare", help="previous results JSON to diff against")
+    ap.add_argument("--verbose", action="store_true", help="show the service's own log lines")
+    args = ap.parse_args()
+
+    upstream = Upstream(args)
+    data_dir = tempfile.mkdtemp(prefix="weather-bench-")
+    configure_env(upstream.base, data_dir, args)
+
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    try:
+        with quiet:
+            results = run_all(args, upstream, data_dir)
+    finally:
+        upstream.close()
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    t, fo = results["today"], results["fanout"]
+    print(f"/today: {t['rps']} req/s, p50 {t['p50_ms']} ms, p99 {t['p99_ms']} ms, {t['errors']} error(s)")
+    print("stages (p50 ms): " + ", ".join(f"{k} {v['p50_ms']}" for k, v in results["stages"].items()))
+    print(f"fan-out: {fo['subscribers']} subscribers / {fo['cities']} cities in {fo['total_s']} s "
+          f"(prepare {fo['prepare_s']} s, deliver {fo['deliver_s']} s, {fo['upstream']['forecast']} forecast call(s))")
+    print(f"wrote {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+"""
+Local stand-in for the upstreams weather-service talks to, for benchmarks.
+
+  GET  /v1/search     Open-Meteo geocoding (any name resolves, except ones containing "nowhere")
+  GET  /v1/forecast   Open-Meteo forecast, including comma-separated batches and hourly arrays
+  POST /send          notifier-gateway /send
+  GET  /stats         request counts, batch sizes and recipients seen; POST /stats/reset clears them
+
+Latency, tail latency, error rate and forecast length are configurable, so runs
+can model a slow or flaky upstream:
+
+  python bench/standin.py --port 8790 --latency-ms 40 --slow-rate 0.02 --slow-ms 1500 --error-rate 0.01
+"""
+import argparse
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+
+class StandIn:
+    def __init__(self, latency_ms: float = 30, jitter_ms: float = 10, slow_rate: float = 0.0, slow_ms: float = 1000,
+                 error_rate: float = 0.0, days: int = 7, send_latency_ms: float = 5):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.days = days
+        self.send_latency_ms = send_latency_ms
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counts = {"geocode": 0, "forecast": 0, "forecast_locations": 0, "send": 0, "errors": 0}
+            self.recipients = 0
+            self.idempotency_keys = set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts, recipients=self.recipients, distinct_keys=len(self.idempotency_keys))
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self.counts[key] += n
+
+    def delay(self, base_ms: Optional[float] = None):
+        ms = self.latency_ms if base_ms is None else base_ms
+        ms = max(0.0, random.gauss(ms, self.jitter_ms)) if self.jitter_ms else ms
+        if self.slow_rate and random.random() < self.slow_rate:
+            ms = self.slow_ms
+        time.sleep(ms / 1000)
+
+    def fail(self) -> bool:
+        if self.error_rate and random.random() < self.error_rate:
+            self._count("errors")
+            return True
+        return False
+
+    # --- payloads ---
+    @staticmethod
+    def place(name: str) -> dict:
+        # deterministic coordinates per name, somewhere in the continental US
+        h = int(hashlib.sha1(name.lower().encode()).hexdigest()[:8], 16)
+        return {"name": name.split(",")[0].strip().title(), "latitude": 25 + (h % 2300) / 100,
+                "longitude": -124 + (h // 2300 % 5600) / 100, "admin1": "Benchland", "country": "United States"}
+
+    def forecast(self, lat: float, lon: float, tz: str, hourly: bool) -> dict:
+        rnd = random.Random(f"{lat:.4f},{lon:.4f}")
+        start = date.today()
+        days = [(start + timedelta(days=i)).isoformat() for i in range(self.days)]
+        hi = [round(rnd.uniform(18, 36), 1) for _ in days]
+        out = {
+            "latitude": lat, "longitude": lon, "timezone": tz,
+            "daily": {
+                "time": days,
+                "weathercode": [rnd.choice((0, 1, 2, 3, 45, 61, 63, 80, 95)) for _ in days],
+                "temperature_2m_max": hi,
+                "temperature_2m_min": [round(h - rnd.uniform(6, 12), 1) for h in hi],
+                "precipitation_probability_max": [rnd.randint(0, 100) for _ in days],
+            },
+        }
+        if hourly:
+            hours = [f"{d}T{h:02d}:00" for d in days for h in range(24)]
+            out["hourly"] = {
+                "time": hours,
+                "temperature_2m": [round(rnd.uniform(15, 36), 1) for _ in hours],
+                "precipitation_probability": [rnd.randint(0, 100) for _ in hours],
+                "wind_speed_10m": [round(rnd.uniform(0, 60), 1) for _ in hours],
+                "uv_index": [round(rnd.uniform(0, 11), 1) for _ in hours],
+            }
+        return out
+
+
+def make_handler(standin: StandIn):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive, like the real upstreams
+
+        def _reply(self, code: int, body):
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path == "/stats":
+                return self._reply(200, standin.stats())
+            if url.path == "/v1/search":
+                standin._count("geocode")
+                standin.delay()
+                if standin.fail():
+                    return self._reply(503, {"error": True, "reason": "stand-in error"})
+                name = q.get("name", "")
+                return self._reply(200, {"results": [] if "nowhere" in name.lower() else [standin.place(name)]})
+            if url.path == "/v1/forecast":
+                lats = [float(v) for v in q.get("latitude", "0").split(",")]
+                lons = [float(v) for v in q.get("longitude", "0").split(",")]
+                tzs = q.get("timezone", "UTC").split(",")
+                tzs = tzs * len(lats) if len(tzs) == 1 else tzs
+                standin._count("forecast")
+                standin._count("forecast_locations", len(lats))
+                standin.delay()
+                if standin.fail():
+                    return self._reply(503, {"error": True, "reason": "stand-in error"})
+                out = [standin.forecast(la, lo, tz, "hourly" in q) for la, lo, tz in zip(lats, lons, tzs)]
+                return self._reply(200, out if len(out) > 1 else out[0])
+            self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlsplit(self.path)
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if url.path == "/stats/reset":
+                standin.reset()
+                return self._reply(200, {"ok": True})
+            if url.path == "/send":
+                standin._count("send")
+                standin.delay(standin.send_latency_ms)
+                if standin.fail():
+                    return self._reply(502, {"ok": False, "error": "stand-in error"})
+                data = json.loads(body or b"{}")
+                to = data.get("to")
+                with standin._lock:
+                    standin.recipients += len(to) if isinstance(to, list) else 1
+                    standin.idempotency_keys.add(self.headers.get("Idempotency-Key"))
+                return self._reply(201, {"ok": True, "status": 201})
+            self._reply(404, {"error": "not found"})
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024   # the default backlog of 5 turns bursts into 1s/3s SYN retries
+
+    def handle_error(self, request, client_address):
+        # clients hang up on purpose (cancelled geocode variants, hedged losers); not worth a traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def serve(standin: StandIn, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Start the stand-in on a background thread; port 0 picks a free one (see server.server_port)."""
+    server = Server((host, port), make_handler(standin))
+    threading.Thread(target=server.serve_forever, name="standin", daemon=True).start()
+    return server
+
+
+def add_arguments(p: argparse.ArgumentParser):
+    p.add_argument("--latency-ms", type=float, default=30, help="mean upstream latency")
+    p.add_argument("--jitter-ms", type=float, default=10, help="std-dev of upstream latency")
+    p.add_argument("--slow-rate", type=float, default=0.0, help="fraction of calls that take --slow-ms")
+    p.add_argument("--slow-ms", type=float, default=1000)
+    p.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 5xx")
+    p.add_argument("--days", type=int, default=7, help="forecast length (hourly arrays are days x 24)")
+    p.add_argument("--send-latency-ms", type=float, default=5, help="stand-in notifier latency")
+
+
+def from_args(args) -> StandIn:
+    return StandIn(args.latency_ms, args.jitter_ms, args.slow_rate, args.slow_ms, args.error_rate, args.days,
+                   args.send_latency_ms)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8790)
+    add_arguments(ap)
+    a = ap.parse_args()
+    srv = serve(from_args(a), a.host, a.port)
+    print(f"stand-in listening on http://{a.host}:{srv.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
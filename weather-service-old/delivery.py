@@ -0,0 +1,204 @@
+import json
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional, Tuple, Union
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import tracing
+from sqlitedb import connect
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    idem_key         TEXT NOT NULL UNIQUE,
+    recipients       TEXT NOT NULL,            -- JSON string or list
+    message          TEXT NOT NULL,
+    created_at       REAL NOT NULL,
+    deadline_at      REAL NOT NULL,
+    next_attempt_at  REAL NOT NULL,
+    attempts         INTEGER NOT NULL DEFAULT 0,
+    status           TEXT NOT NULL DEFAULT 'pending',   -- pending | sent | expired | failed
+    last_error       TEXT,
+    done_at          REAL,
+    traceparent      TEXT                      -- trace of the run that queued it; sends continue it
+);
+CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+# payload shapes the gateway may accept; the one that last worked is tried first
+SHAPES = ("header", "body")
+
+
+class DeliveryQueue:
+    """
+    Durable outbox for notifier-gateway messages.
+
+    enqueue() writes the message to SQLite and returns; a worker thread sends
+    due rows over one keep-alive session, retrying with exponential backoff
+    until the row's deadline. Each row has an idempotency key: enqueueing the
+    same key twice is a no-op, and the key goes out as an Idempotency-Key header.
+    """
+
+    def __init__(self, path: str, url: str, token: str, deadline: float = 3600, max_backoff: float = 300,
+                 retain: float = 7 * 86400):
+        self.path = path
+        self.url = url
+        self.token = token
+        self.deadline = deadline
+        self.max_backoff = max_backoff
+        self.retain = retain
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+        self._session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+        self._shape = SHAPES[0]
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """The connection, opened (and the schema migrated) on first use rather than at import."""
+        if self._conn is None:
+            with self._open_lock:
+                if self._conn is None:
+                    db = connect(self.path, SCHEMA)
+                    row = db.execute("SELECT value FROM meta WHERE key = 'payload_shape'").fetchone()
+                    self._shape = row["value"] if row else SHAPES[0]
+                    self._conn = db
+        return self._conn
+
+    # --- meta ---
+    def _set_meta(self, key: str, value: str):
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # --- producer ---
+    def enqueue(self, to: Union[str, List[str]], message: str, idem_key: str,
+                deadline: Optional[float] = None, traceparent: Optional[str] = None) -> bool:
+        """Queue a message; False if `idem_key` was already queued (sent or not)."""
+        now = time.time()
+        with self._lock, self._db:
+            cur = self._db.execute(
+                "INSERT OR IGNORE INTO outbox (idem_key, recipients, message, created_at, deadline_at, next_attempt_at, "
+                "traceparent) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (idem_key, json.dumps(to), message, now, now + (deadline or self.deadline), now, traceparent),
+            )
+        if cur.rowcount:
+            self._wake.set()
+        return cur.rowcount > 0
+
+    # --- worker ---
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="delivery", daemon=True)
+            self._thread.start()
+
+    def _loop(self):
+        last_prune = 0.0
+        while True:
+            try:
+                self.drain_once()
+                if time.time() - last_prune > 3600:
+                    self._prune()
+                    last_prune = time.time()
+            except Exception as e:
+                print("[delivery] worker error:", e)
+            self._wake.wait(self._next_due_in())
+            self._wake.clear()
+
+    def _next_due_in(self) -> float:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(next_attempt_at) AS t FROM outbox WHERE status = 'pending'").fetchone()
+        if row["t"] is None:
+            return 3600.0
+        return max(0.0, min(3600.0, row["t"] - time.time()))
+
+    def drain_once(self, limit: int = 50) -> int:
+        """Attempt every due row once; returns how many were delivered."""
+        now = time.time()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT * FROM outbox WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at LIMIT ?", (now, limit)).fetchall()
+        sent = 0
+        for row in rows:
+            if time.time() > row["deadline_at"]:
+                self._finish(row["id"], "expired", row["last_error"], attempted=False)
+                print(f"[delivery] {row['idem_key']} expired after {row['attempts']} attempt(s): {row['last_error']}")
+                continue
+            with tracing.span("outbox.send", parent=row["traceparent"], idem_key=row["idem_key"][:12],
+                              attempt=row["attempts"] + 1,
+                              queued_ms=round((time.time() - row["created_at"]) * 1000)) as sp:
+                ok, permanent, err = self._send(json.loads(row["recipients"]), row["message"], row["idem_key"])
+                sp.set(delivered=ok)
+                if err:
+                    sp.status = "error"
+                    sp.set(error=err)
+            if ok:
+                self._finish(row["id"], "sent", None)
+                sent += 1
+            elif permanent:
+                self._finish(row["id"], "failed", err)
+                print(f"[delivery] {row['idem_key']} rejected: {err}")
+            else:
+                attempts = row["attempts"] + 1
+                delay = min(self.max_backoff, 2 ** attempts) * random.uniform(0.8, 1.2)
+                with self._lock, self._db:
+                    self._db.execute(
+                        "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+                        (attempts, time.time() + delay, err, row["id"]))
+                print(f"[delivery] {row['idem_key']} attempt {attempts} failed ({err}); retry in {delay:.0f}s")
+        return sent
+
+    def _finish(self, row_id: int, status: str, err: Optional[str], attempted: bool = True):
+        with self._lock, self._db:
+            self._db.execute("UPDATE outbox SET status = ?, last_error = ?, done_at = ?, attempts = attempts + ? "
+                             "WHERE id = ?", (status, err, time.time(), int(attempted), row_id))
+
+    def _payload(self, shape: str, to, message: str) -> Tuple[dict, Dict[str, str]]:
+        if shape == "header":
+            return {"to": to, "message": message}, ({"Authorization": f"Bearer {self.token}"} if self.token else {})
+        return {"to": to, "message": message, "token": self.token}, {}
+
+    def _send(self, to, message: str, idem_key: str) -> Tuple[bool, bool, Optional[str]]:
+        """(delivered, permanent failure, error)."""
+        shapes = [self._shape] + [s for s in SHAPES if s != self._shape]
+        if not self.token:
+            shapes = ["header"]   # nothing to put in the body
+        last_err, rejected = None, True
+        for shape in shapes:
+            body, headers = self._payload(shape, to, message)
+            try:
+                with tracing.span("http.gateway_send", shape=shape) as sp:
+                    r = self._session.post(self.url, json=body, timeout=15,
+                                           headers=tracing.inject({**headers, "Idempotency-Key": idem_key}))
+                    sp.set(status=r.status_code)
+            except requests.RequestException as e:
+                return False, False, str(e)   # gateway unreachable: no point trying the other shape now
+            if 200 <= r.status_code < 300:
+                if shape != self._shape:
+                    self._shape = shape
+                    self._set_meta("payload_shape", shape)
+                return True, False, None
+            last_err = f"{r.status_code} {r.text[:160]!r}"
+            if r.status_code in (408, 429) or r.status_code >= 500:
+                rejected = False
+        return False, rejected, last_err
+
+    def _prune(self):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM outbox WHERE status != 'pending' AND done_at < ?",
+                             (time.time() - self.retain,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._db.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+        return dict({r["status"]: r["n"] for r in rows}, payload_shape=self._shape)
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class ForecastCache:
+    """
+    Stale-while-revalidate cache for upstream forecasts.
+
+    An entry is fresh until the next model update is expected (the next
+    `cadence` boundary after it was fetched, shifted by `publish_lag`).
+    After that it is served stale for up to `max_stale` seconds while one
+    background refresh runs; beyond that callers block on a fetch.
+    Concurrent loads of the same key share one upstream call (single-flight).
+
+    `ttl_for(value)` may return a shorter lifetime in seconds for a value (e.g.
+    a fallback provider's partial forecast); such an entry is fresh for that
+    long and then a miss, never served stale.
+    """
+
+    def __init__(self, pool: Executor, cadence: float, publish_lag: float, max_stale: float, max_entries: int,
+                 ttl_for: Optional[Callable[[Any], Optional[float]]] = None):
+        self.pool = pool
+        self.cadence = cadence
+        self.publish_lag = publish_lag
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        self.ttl_for = ttl_for
+        self._lock = threading.Lock()
+        # key -> (fetched_at, value, ttl or None)
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, Optional[float]]]" = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = {}
+        self.counts = {"fresh": 0, "stale": 0, "miss": 0, "errors": 0}
+
+    def fresh_until(self, fetched_at: float) -> float:
+        n = (fetched_at - self.publish_lag) // self.cadence + 1
+        return n * self.cadence + self.publish_lag
+
+    def peek(self, key: Hashable, record: bool = False) -> Tuple[Optional[Any], str]:
+        """Return (value, "fresh" | "stale" | "miss") without loading anything; `record` counts it in stats()."""
+        value, state = self._peek(key)
+        if record:
+            with self._lock:
+                self.counts[state] += 1
+        return value, state
+
+    def _peek(self, key: Hashable) -> Tuple[Optional[Any], str]:
+        now = time.time()
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None:
+                return None, "miss"
+            self._entries.move_to_end(key)
+        if e[2] is not None:
+            return (e[1], "fresh") if now < e[0] + e[2] else (None, "miss")
+        until = self.fresh_until(e[0])
+        if now < until:
+            return e[1], "fresh"
+        if now < until + self.max_stale:
+            return e[1], "stale"
+        return None, "miss"
+
+    def put(self, key: Hashable, value: Any, fetched_at: Optional[float] = None):
+        ttl = self.ttl_for(value) if self.ttl_for else None
+        with self._lock:
+            self._entries[key] = (fetched_at or time.time(), value, ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        value, state = self.peek(key, record=True)
+        if state == "fresh":
+            return value
+        if state == "stale":
+            self.refresh(key, loader)
+            return value
+        return self._load(key, loader).result()
+
+    def refresh(self, key: Hashable, loader: Callable[[], Any]) -> Future:
+        """Start a background reload of `key` unless one is already running."""
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut
+            fut = self._inflight[key] = Future()
+        self.pool.submit(self._run, key, loader, fut)
+        return fut
+
+    def _load(self, key: Hashable, loader: Callable[[], Any]) -> Future:
+        with self._lock:
+            fut = self._inflight.get(key)
+            if fut is not None:
+                return fut
+            fut = self._inflight[key] = Future()
+        self._run(key, loader, fut)
+        return fut
+
+    def _run(self, key: Hashable, loader: Callable[[], Any], fut: Future):
+        try:
+            value = loader()
+            self.put(key, value)
+            fut.set_result(value)
+        except BaseException as e:
+            with self._lock:
+                self.counts["errors"] += 1
+            fut.set_exception(e)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts, entries=len(self._entries), inflight=len(self._inflight))
@@ -0,0 +1,233 @@
+"""
+Offline US place index for geocode().
+
+The index is a single memory-mapped file built from a GeoNames dump
+(cities500.txt / cities1000.txt / US.txt, plain or zipped):
+
+    python gazetteer.py build <path-or-url> gazetteer.idx
+
+Layout (little-endian):
+    header   "GZ01", u32 count, u32 pool_offset
+    records  count x RECORD, sorted by (key, -population)
+    pool     utf-8 keys and display names referenced by the records
+
+Lookups binary-search the mmap directly, so opening the index costs nothing
+and only the touched pages are ever read.
+"""
+import difflib
+import io
+import mmap
+import os
+import struct
+import sys
+import unicodedata
+import urllib.request
+import zipfile
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+MAGIC = b"GZ01"
+HEADER = struct.Struct("<4sII")
+# key_off, key_len, name_off, name_len, state, lat, lon, population
+RECORD = struct.Struct("<IHIH2sffI")
+
+# token rewrites so "St. Louis" == "Saint Louis", "Ft Myers" == "Fort Myers"
+_TOKENS = {"st": "saint", "ste": "sainte", "ft": "fort", "mt": "mount"}
+
+
+class Place(NamedTuple):
+    name: str
+    state: str
+    lat: float
+    lon: float
+    population: int
+
+
+def normalize(name: str) -> str:
+    s = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode().lower()
+    s = "".join(ch if ch.isalnum() else " " for ch in s)
+    return " ".join(_TOKENS.get(t, t) for t in s.split())
+
+
+class Gazetteer:
+    def __init__(self, path: str, fuzzy_cutoff: float = 0.85, fuzzy_margin: float = 0.05):
+        self.path = path
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.fuzzy_margin = fuzzy_margin   # a fuzzy hit must beat the next-best other name by this much
+        self._f = open(path, "rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self._pool = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a gazetteer index")
+
+    def close(self):
+        self._mm.close()
+        self._f.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    # --- record access ---
+    def _key(self, i: int) -> bytes:
+        off, n = struct.unpack_from("<IH", self._mm, HEADER.size + i * RECORD.size)
+        return self._mm[self._pool + off:self._pool + off + n]
+
+    def _place(self, i: int) -> Place:
+        _, _, noff, nlen, st, lat, lon, pop = RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+        name = self._mm[self._pool + noff:self._pool + noff + nlen].decode("utf-8")
+        return Place(name, st.decode("ascii"), lat, lon, pop)
+
+    def _state(self, i: int) -> bytes:
+        return self._mm[HEADER.size + i * RECORD.size + 12:HEADER.size + i * RECORD.size + 14]
+
+    def _bisect(self, key: bytes) -> int:
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _range(self, lo_key: bytes, hi_key: bytes) -> range:
+        return range(self._bisect(lo_key), self._bisect(hi_key))
+
+    def _best(self, idx: Iterator[int], state: Optional[bytes]) -> Optional[Place]:
+        best = None
+        for i in idx:
+            if state and self._state(i) != state:
+                continue
+            p = self._place(i)
+            if best is None or p.population > best.population:
+                best = p
+        return best
+
+    # --- lookups ---
+    def exact(self, city: str, state: Optional[str] = None) -> Optional[Place]:
+        k = normalize(city).encode()
+        return self._best(iter(self._range(k, k + b"\x00")), _st(state)) if k else None
+
+    def prefix(self, city: str, state: Optional[str] = None, min_len: int = 4) -> Optional[Place]:
+        """The place whose name starts with `city`, only if one name does ("Port" matches too many)."""
+        k = normalize(city).encode()
+        if len(k) < min_len:
+            return None
+        st = _st(state)
+        idx = [i for i in self._range(k, k + b"\xff") if not st or self._state(i) == st]
+        if len({self._key(i) for i in idx}) != 1:
+            return None
+        return self._best(iter(idx), st)
+
+    def fuzzy(self, city: str, state: Optional[str] = None) -> Optional[Place]:
+        # candidates share the first two characters; typos past that are what we're catching
+        k = normalize(city)
+        if len(k) < 4:
+            return None
+        st = _st(state)
+        sm = difflib.SequenceMatcher(b=k, autojunk=False)
+        scores = {}   # name key -> (score, most populous place with it)
+        floor = self.fuzzy_cutoff
+        for i in self._range(k[:2].encode(), k[:2].encode() + b"\xff"):
+            if st and self._state(i) != st:
+                continue
+            key = self._key(i)
+            sm.set_seq1(key.decode())
+            if sm.real_quick_ratio() < floor or sm.quick_ratio() < floor:
+                continue
+            score = sm.ratio()
+            if score < floor:
+                continue
+            p = self._place(i)
+            if key not in scores or p.population > scores[key][1].population:
+                scores[key] = (score, p)
+            # names further than the margin below the best can't make it ambiguous
+            floor = max(floor, max(sc for sc, _ in scores.values()) - self.fuzzy_margin)
+        ranked = sorted(scores.values(), key=lambda sp: sp[0], reverse=True)
+        if not ranked or (len(ranked) > 1 and ranked[0][0] - ranked[1][0] < self.fuzzy_margin):
+            return None   # close call between names: let the network geocoder decide
+        return ranked[0][1]
+
+    def lookup(self, city: str, state: Optional[str] = None) -> Optional[Place]:
+        """
+        Exact, then prefix, then fuzzy; prefix/fuzzy only when a state narrows the search
+        and only for an unambiguous match, so anything else falls through to the network.
+        """
+        place = self.exact(city, state)
+        if place or not state:
+            return place
+        return self.prefix(city, state) or self.fuzzy(city, state)
+
+
+def _st(state: Optional[str]) -> Optional[bytes]:
+    s = (state or "").strip().upper()
+    return s.encode("ascii") if len(s) == 2 else None
+
+
+# ------------ Index build ------------
+def _geonames_rows(src: str) -> Iterator[Tuple[str, str, float, float, int]]:
+    """Yield (name, state, lat, lon, population) for US populated places in a GeoNames dump."""
+    if src.startswith(("http://", "https://")):
+        with urllib.request.urlopen(src, timeout=120) as r:
+            blob = r.read()
+    else:
+        with open(src, "rb") as f:
+            blob = f.read()
+    if blob[:2] == b"PK":
+        with zipfile.ZipFile(io.BytesIO(blob)) as z:
+            blob = z.read(next(n for n in z.namelist() if n.endswith(".txt")))
+    for line in io.TextIOWrapper(io.BytesIO(blob), encoding="utf-8"):
+        cols = line.rstrip("\n").split("\t")
+        if len(cols) < 15 or cols[8] != "US" or cols[6] != "P":
+            continue
+        yield cols[1], cols[10], float(cols[4]), float(cols[5]), int(cols[14] or 0)
+
+
+def build_index(src: str, out: str) -> int:
+    rows = []
+    for name, state, lat, lon, pop in _geonames_rows(src):
+        key = normalize(name)
+        if key and len(state) == 2:
+            rows.append((key, -pop, name, state, lat, lon, pop))
+    rows.sort()
+
+    pool = bytearray()
+    offsets = {}
+    def intern(s: str) -> Tuple[int, int]:
+        if s not in offsets:
+            b = s.encode("utf-8")
+            offsets[s] = (len(pool), len(b))
+            pool.extend(b)
+        return offsets[s]
+
+    records = bytearray()
+    for key, _, name, state, lat, lon, pop in rows:
+        koff, klen = intern(key)
+        noff, nlen = intern(name)
+        records += RECORD.pack(koff, klen, noff, nlen, state.encode("ascii"), lat, lon, min(pop, 2**32 - 1))
+
+    tmp = out + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(rows), HEADER.size + len(records)))
+        f.write(records)
+        f.write(pool)
+    os.replace(tmp, out)
+    return len(rows)
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) == 3 and argv[0] == "build":
+        n = build_index(argv[1], argv[2])
+        print(f"[gazetteer] wrote {n} places to {argv[2]}")
+        return 0
+    if len(argv) in (2, 3) and argv[0] == "lookup":
+        g = Gazetteer(os.getenv("GAZETTEER_PATH", "gazetteer.idx"))
+        print(g.lookup(argv[1], argv[2] if len(argv) == 3 else None))
+        return 0
+    print("usage: gazetteer.py build <geonames.txt|.zip|url> <out.idx>\n"
+          "       gazetteer.py lookup <city> [state]", file=sys.stderr)
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
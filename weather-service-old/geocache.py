@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from snapshot import load_snapshot, save_snapshot
+
+Place = Tuple[float, float, str]
+
+
+class GeoCache:
+    """
+    LRU + TTL cache of geocode results, persisted to a JSON file.
+
+    Writes only mark the cache dirty; the owner calls save() periodically and
+    at exit, so a miss never pays for rewriting the whole file.
+
+    Positive entries live for `ttl` seconds; negative entries (a place that
+    definitively did not geocode) live for `negative_ttl` so typos don't
+    hammer the API but a transient miss is retried soon.
+    """
+
+    def __init__(self, path: Optional[str], ttl: float, negative_ttl: float, max_entries: int):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (expires_at, place or None, error or None)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._dirty = False
+        self.hits = self.misses = 0
+
+    def get(self, key: str) -> Tuple[bool, Optional[Place], Optional[str]]:
+        """Return (hit, place, error); a negative hit has place=None and the cached error."""
+        now = time.time()
+        with self._lock:
+            e = self._entries.get(key)
+            if e is None or e[0] <= now:
+                if e is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, e[1], e[2]
+
+    def put(self, key: str, place: Place):
+        self._set(key, (time.time() + self.ttl, tuple(place), None))
+
+    def put_negative(self, key: str, error: str):
+        self._set(key, (time.time() + self.negative_ttl, None, error))
+
+    def _set(self, key: str, entry: tuple):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    def load(self):
+        if not self.path:
+            return
+        now = time.time()
+        rows = load_snapshot(self.path).get("entries") or []
+        with self._lock:
+            # rows are saved oldest-first, so replaying them restores LRU order
+            for key, expires_at, place, error in rows:
+                if expires_at > now:
+                    self._entries[key] = (expires_at, tuple(place) if place else None, error)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if rows:
+            print(f"[geocache] loaded {len(self._entries)} entries from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            rows = [[k, e[0], list(e[1]) if e[1] else None, e[2]] for k, e in self._entries.items()]
+            self._dirty = False
+        if not save_snapshot(self.path, {"entries": rows}):
+            with self._lock:
+                self._dirty = True   # try again on the next flush
@@ -0,0 +1,299 @@
+"""
+Forecast providers behind one normalized model, with hedged requests.
+
+Every provider returns Open-Meteo's shape, which the rest of the service
+already consumes: {"daily": {"time", "weathercode", "temperature_2m_max",
+"temperature_2m_min", "precipitation_probability_max"}, "hourly": {...}}
+with WMO weather codes, °C, % and km/h, plus "provider" naming the source.
+
+Hedger asks the first provider, and if it hasn't answered within its own
+recent p95 latency asks the next one too; the first good answer wins.
+"""
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Executor, Future, wait
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import httpx
+import requests
+
+import tracing
+
+DAILY_FIELDS = "weathercode,temperature_2m_max,temperature_2m_min,precipitation_probability_max"
+HOURLY_FIELDS = "temperature_2m,precipitation_probability,wind_speed_10m,uv_index"
+
+# wttr.in (WorldWeatherOnline) condition codes -> closest WMO code
+WWO_TO_WMO = {
+    113: 0, 116: 2, 119: 3, 122: 3,
+    143: 45, 248: 45, 260: 48,
+    263: 51, 266: 53, 281: 55, 284: 55,
+    176: 80, 293: 61, 296: 61, 299: 63, 302: 63, 305: 65, 308: 65,
+    353: 80, 356: 81, 359: 82,
+    185: 55, 311: 61, 314: 65, 317: 61, 320: 73, 350: 73, 362: 80, 365: 81, 374: 80, 377: 81,
+    179: 71, 182: 71, 227: 73, 230: 75, 323: 71, 326: 71, 329: 73, 332: 73, 335: 75, 338: 75,
+    368: 71, 371: 75,
+    200: 95, 386: 95, 389: 95, 392: 96, 395: 96,
+}
+
+
+class LatencyStats:
+    """Rolling window of successful call latencies (seconds) plus success/error counts."""
+
+    def __init__(self, window: int = 200):
+        self._samples: deque = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.ok = 0
+        self.errors = 0
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+            self.ok += 1
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def summary(self) -> dict:
+        p50, p95 = self.quantile(0.5), self.quantile(0.95)
+        return {"n": len(self), "ok": self.ok, "errors": self.errors,
+                "p50_ms": round(p50 * 1000) if p50 is not None else None,
+                "p95_ms": round(p95 * 1000) if p95 is not None else None}
+
+
+class Provider:
+    name = "provider"
+
+    def __init__(self, timeout: float = 15, window: int = 200):
+        self.timeout = timeout
+        self.stats = LatencyStats(window)
+
+    def request(self, lat: float, lon: float, tzname: str, hourly: bool) -> dict:
+        """kwargs for requests.get / httpx.AsyncClient.get."""
+        raise NotImplementedError
+
+    def normalize(self, data, hourly: bool) -> dict:
+        raise NotImplementedError
+
+    def fetch(self, lat: float, lon: float, tzname: str, hourly: bool = False) -> dict:
+        with tracing.span("http.forecast", provider=self.name, lat=lat, lon=lon, hourly=hourly) as sp:
+            t0 = time.monotonic()
+            try:
+                req = self.request(lat, lon, tzname, hourly)
+                r = requests.get(req.pop("url"), headers=tracing.inject(), timeout=self.timeout, **req)
+                sp.set(status=r.status_code)
+                r.raise_for_status()
+                out = self.normalize(r.json(), hourly)
+            except Exception:
+                self.stats.error()
+                raise
+            self.stats.record(time.monotonic() - t0)
+            return out
+
+    async def afetch(self, client: httpx.AsyncClient, lat: float, lon: float, tzname: str,
+                     hourly: bool = False) -> dict:
+        with tracing.span("http.forecast", provider=self.name, lat=lat, lon=lon, hourly=hourly) as sp:
+            t0 = time.monotonic()
+            try:
+                req = self.request(lat, lon, tzname, hourly)
+                r = await client.get(req.pop("url"), headers=tracing.inject(), timeout=self.timeout, **req)
+                sp.set(status=r.status_code)
+                r.raise_for_status()
+                out = self.normalize(r.json(), hourly)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.stats.error()
+                raise
+            self.stats.record(time.monotonic() - t0)
+            return out
+
+
+class OpenMeteo(Provider):
+    name = "open-meteo"
+
+    def __init__(self, url: str = "https://api.open-meteo.com/v1/forecast", **kw):
+        super().__init__(**kw)
+        self.url = url
+
+    def request(self, lat, lon, tzname, hourly):
+        params = {"latitude": lat, "longitude": lon, "daily": DAILY_FIELDS, "timezone": tzname}
+        if hourly:
+            params["hourly"] = HOURLY_FIELDS
+        return {"url": self.url, "params": params}
+
+    def normalize(self, data, hourly):
+        if not (data or {}).get("daily"):
+            raise ValueError("open-meteo returned no daily forecast")
+        return dict(data, provider=self.name)
+
+
+class Wttr(Provider):
+    """
+    wttr.in JSON ("format=j1"): 3 days of 3-hourly points in the location's local time.
+    Hourly series are expanded to 1-hour steps by holding each 3-hour value.
+    """
+    name = "wttr"
+
+    def __init__(self, url: str = "https://wttr.in", **kw):
+        super().__init__(**kw)
+        self.url = url.rstrip("/")
+
+    def request(self, lat, lon, tzname, hourly):
+        return {"url": f"{self.url}/{lat:.4f},{lon:.4f}", "params": {"format": "j1"}}
+
+    @staticmethod
+    def _wmo(code) -> int:
+        try:
+            return WWO_TO_WMO.get(int(code), 3)
+        except (TypeError, ValueError):
+            return 3
+
+    @staticmethod
+    def _float(v) -> Optional[float]:
+        try:
+            return float(v)
+        except (TypeError, ValueError):
+            return None
+
+    def normalize(self, data, hourly):
+        days = (data or {}).get("weather") or []
+        if not days:
+            raise ValueError("wttr.in returned no forecast")
+        daily = {"time": [], "weathercode": [], "temperature_2m_max": [], "temperature_2m_min": [],
+                 "precipitation_probability_max": []}
+        series: Dict[str, List] = {"time": [], "temperature_2m": [], "precipitation_probability": [],
+                                   "wind_speed_10m": [], "uv_index": []}
+        for day in days:
+            points = day.get("hourly") or []
+            daily["time"].append(day["date"])
+            # like Open-Meteo's daily code: the most severe condition of the day
+            daily["weathercode"].append(max((self._wmo(p.get("weatherCode")) for p in points), default=3))
+            daily["temperature_2m_max"].append(self._float(day.get("maxtempC")))
+            daily["temperature_2m_min"].append(self._float(day.get("mintempC")))
+            daily["precipitation_probability_max"].append(
+                max((self._float(p.get("chanceofrain")) or 0 for p in points), default=None))
+            if hourly:
+                base = datetime.fromisoformat(day["date"])
+                for p in points:
+                    start = int(p.get("time") or 0) // 100
+                    for h in range(start, min(start + 3, 24)):
+                        series["time"].append((base + timedelta(hours=h)).strftime("%Y-%m-%dT%H:%M"))
+                        series["temperature_2m"].append(self._float(p.get("tempC")))
+                        series["precipitation_probability"].append(self._float(p.get("chanceofrain")))
+                        series["wind_speed_10m"].append(self._float(p.get("windspeedKmph")))
+                        series["uv_index"].append(self._float(p.get("uvIndex")))
+        out = {"daily": daily, "provider": self.name}
+        if hourly:
+            out["hourly"] = series
+        return out
+
+
+class Hedger:
+    """
+    Hedged fetch across providers in priority order. Provider i+1 is asked once
+    provider i has been outstanding for its p95 latency (clamped to
+    [min_delay, max_delay]; `max_delay` until it has `min_samples` samples), or
+    right away if provider i fails. Slower calls are not cancelled in the sync
+    path, so their latencies still feed the stats.
+    """
+
+    def __init__(self, providers: List[Provider], pool: Executor, min_delay: float = 0.05,
+                 max_delay: float = 3.0, min_samples: int = 20):
+        if not providers:
+            raise ValueError("at least one provider is required")
+        self.providers = providers
+        self.pool = pool
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self.counts = {"calls": 0, "hedged": 0, "wins": {p.name: 0 for p in providers}}
+
+    def hedge_after(self, provider: Provider) -> float:
+        p95 = provider.stats.quantile(0.95)
+        if p95 is None or len(provider.stats) < self.min_samples:
+            return self.max_delay
+        return min(self.max_delay, max(self.min_delay, p95))
+
+    def _count(self, hedged: bool, winner: Optional[str]):
+        with self._lock:
+            self.counts["calls"] += 1
+            self.counts["hedged"] += int(hedged)
+            if winner:
+                self.counts["wins"][winner] += 1
+
+    def fetch(self, lat: float, lon: float, tzname: str, hourly: bool = False) -> dict:
+        pending: Dict[Future, Provider] = {}
+        queue = list(self.providers)
+        last_err: Optional[Exception] = None
+        while queue or pending:
+            if queue:
+                p = queue.pop(0)
+                pending[self.pool.submit(tracing.bind(p.fetch), lat, lon, tzname, hourly)] = p
+                done, _ = wait(pending, timeout=self.hedge_after(p) if queue else None, return_when=FIRST_COMPLETED)
+            else:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                pending.pop(f)
+                try:
+                    out = f.result()
+                except Exception as e:
+                    last_err = e
+                    continue
+                self._count(len(self.providers) - len(queue) > 1, out.get("provider"))
+                return out
+        self._count(len(self.providers) > 1, None)
+        raise last_err or RuntimeError("no forecast provider answered")
+
+    async def afetch(self, client: httpx.AsyncClient, lat: float, lon: float, tzname: str,
+                     hourly: bool = False) -> dict:
+        pending: Dict[asyncio.Task, Provider] = {}
+        queue = list(self.providers)
+        last_err: Optional[Exception] = None
+        try:
+            while queue or pending:
+                if queue:
+                    p = queue.pop(0)
+                    pending[asyncio.create_task(p.afetch(client, lat, lon, tzname, hourly))] = p
+                    done, _ = await asyncio.wait(pending, timeout=self.hedge_after(p) if queue else None,
+                                                 return_when=asyncio.FIRST_COMPLETED)
+                else:
+                    done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    pending.pop(t)
+                    if t.exception() is not None:
+                        last_err = t.exception()
+                        continue
+                    out = t.result()
+                    self._count(len(self.providers) - len(queue) > 1, out.get("provider"))
+                    return out
+        finally:
+            for t in pending:
+                # let the losers finish in the background so their latency is still recorded
+                t.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._count(len(self.providers) > 1, None)
+        raise last_err or RuntimeError("no forecast provider answered")
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = {"calls": self.counts["calls"], "hedged": self.counts["hedged"], "wins": dict(self.counts["wins"])}
+        counts["providers"] = {p.name: dict(p.stats.summary(), hedge_after_ms=round(self.hedge_after(p) * 1000))
+                               for p in self.providers}
+        return counts
+
+
+PROVIDERS = {"open-meteo": OpenMeteo, "wttr": Wttr}
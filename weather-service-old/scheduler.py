@@ -0,0 +1,265 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import pytz
+from croniter import croniter
+
+MISFIRE_POLICIES = ("skip", "coalesce", "all")
+
+
+class Job:
+    __slots__ = ("id", "cron", "tz", "func", "args", "batch", "prewarm", "next_fire", "last_fired", "gen",
+                 "running")
+
+    def __init__(self, job_id: str, cron: str, tz: str, func: Callable, args: Any, batch: bool,
+                 prewarm: Optional[Callable] = None):
+        self.id = job_id
+        self.cron = cron
+        self.tz = pytz.timezone(tz)
+        self.func = func
+        self.args = args
+        self.batch = batch
+        self.prewarm = prewarm
+        self.next_fire: Optional[float] = None
+        self.last_fired: Optional[float] = None
+        self.gen = 0
+        self.running = False
+
+    def next_after(self, ts: float) -> float:
+        return croniter(self.cron, datetime.fromtimestamp(ts, self.tz)).get_next(float)
+
+    def prev_before(self, ts: float) -> float:
+        return croniter(self.cron, datetime.fromtimestamp(ts, self.tz)).get_prev(float)
+
+
+class Scheduler:
+    """
+    Cron scheduler backed by a heap of fire times.
+
+    The loop thread sleeps on a condition until the earliest job is due (or the
+    heap changes), so idle cost doesn't grow with the number of jobs. Jobs run
+    on a bounded worker pool and receive their *scheduled* fire time, and the
+    next fire is computed from that time, not from when the run finished, so a
+    slow run never drifts or silently skips a slot.
+
+    Jobs added with batch=True that come due at the same instant with the same
+    func are delivered together as func([args, ...], fire_at).
+
+    Slots that were missed (e.g. while the service was down) are handled per
+    `misfire_policy`:
+      skip      drop every slot later than `misfire_grace`, resume from now
+      coalesce  run once, for the newest missed slot, and only if that slot is
+                within `misfire_grace`; otherwise skip; resume from now
+      all       run every missed slot in turn
+    `jitter` delays each fire instant by up to that many seconds. The delay is
+    derived from the instant itself, so jobs due together still wake together
+    and batch together.
+
+    A job added with a `prewarm` callable also gets prewarm(args, fire_at) called
+    `prewarm_lead` seconds before each fire (batched the same way as func), so
+    slow work can be done ahead and the fire itself only delivers. A slot that is
+    already closer than the lead when scheduled gets no prewarm call.
+    """
+
+    def __init__(self, workers: int = 4, misfire_policy: str = "coalesce", misfire_grace: float = 3600,
+                 jitter: float = 0, on_run: Optional[Callable[[], None]] = None, prewarm_lead: float = 0):
+        if misfire_policy not in MISFIRE_POLICIES:
+            raise ValueError(f"misfire_policy must be one of {MISFIRE_POLICIES}")
+        self.misfire_policy = misfire_policy
+        self.misfire_grace = misfire_grace
+        self.jitter = jitter
+        self.on_run = on_run  # called after every run, e.g. to persist state()
+        self.prewarm_lead = prewarm_lead
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sched-worker")
+        self._cond = threading.Condition()
+        self._heap: List[tuple] = []   # (wake_at, seq, job_id, gen, fire_at)
+        self._warm: List[tuple] = []   # (prewarm_at, seq, job_id, gen, fire_at)
+        self._jobs: Dict[str, Job] = {}
+        self._seq = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    # --- job management ---
+    def add_job(self, job_id: str, cron: str, tz: str, func: Callable, args: Any = None, batch: bool = False,
+                next_fire: Optional[float] = None, last_fired: Optional[float] = None,
+                prewarm: Optional[Callable] = None) -> Job:
+        """Add or replace a job. `next_fire`/`last_fired` restore a previous state() entry."""
+        job = Job(job_id, cron, tz, func, args, batch, prewarm)
+        job.last_fired = last_fired
+        with self._cond:
+            old = self._jobs.get(job_id)
+            if old is not None:
+                job.gen = old.gen + 1
+                job.running = old.running
+                job.last_fired = job.last_fired or old.last_fired
+            self._jobs[job_id] = job
+            self._push(job, next_fire if next_fire is not None else job.next_after(time.time()))
+        return job
+
+    def remove_job(self, job_id: str) -> bool:
+        with self._cond:
+            job = self._jobs.pop(job_id, None)
+            if job is not None:
+                job.gen += 1   # invalidates its heap entries
+                self._cond.notify()
+            return job is not None
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def state(self) -> Dict[str, dict]:
+        with self._cond:
+            return {j.id: {"next": j.next_fire, "last": j.last_fired, "cron": j.cron, "tz": j.tz.zone}
+                    for j in self._jobs.values()}
+
+    def stats(self) -> dict:
+        with self._cond:
+            nxt = self._heap[0][4] if self._heap else None
+            return {"jobs": len(self._jobs), "heap": len(self._heap), "prewarm_heap": len(self._warm),
+                    "next_fire": nxt, "misfire_policy": self.misfire_policy, "prewarm_lead": self.prewarm_lead}
+
+    def _push(self, job: Job, fire_at: float):
+        # caller holds self._cond
+        job.next_fire = fire_at
+        # one delay per instant, not per job: jobs sharing fire_at must be collected in the same pass
+        wake = fire_at + (random.Random(fire_at).uniform(0, self.jitter) if self.jitter else 0)
+        heapq.heappush(self._heap, (wake, next(self._seq), job.id, job.gen, fire_at))
+        if job.prewarm is not None and self.prewarm_lead > 0 and fire_at - self.prewarm_lead > time.time():
+            heapq.heappush(self._warm, (fire_at - self.prewarm_lead, next(self._seq), job.id, job.gen, fire_at))
+        # drop dead entries once they dominate, so removals don't leak memory
+        if len(self._heap) > 2 * len(self._jobs) + 64:
+            self._heap = self._live(self._heap)
+        if len(self._warm) > 2 * len(self._jobs) + 64:
+            self._warm = self._live(self._warm)
+        self._cond.notify()
+
+    def _live(self, heap: List[tuple]) -> List[tuple]:
+        heap = [e for e in heap if e[2] in self._jobs and self._jobs[e[2]].gen == e[3]]
+        heapq.heapify(heap)
+        return heap
+
+    # --- loop ---
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._stopped:
+                    heads = [h[0][0] for h in (self._heap, self._warm) if h]
+                    if not heads:
+                        self._cond.wait()
+                        continue
+                    delay = min(heads) - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+                if self._stopped:
+                    return
+                now = time.time()
+                warm = self._collect_warm(now)
+                due = self._collect(now)
+            self._dispatch_warm(warm)
+            self._dispatch(due)
+
+    def _collect_warm(self, now: float) -> List[tuple]:
+        # caller holds self._cond; pops every prewarm entry that is due
+        warm = []
+        while self._warm and self._warm[0][0] <= now:
+            _, _, job_id, gen, fire_at = heapq.heappop(self._warm)
+            job = self._jobs.get(job_id)
+            if job is not None and job.gen == gen and job.prewarm is not None:
+                warm.append((job, fire_at))
+        return warm
+
+    def _dispatch_warm(self, warm: List[tuple]):
+        batches: Dict[tuple, List[Job]] = {}
+        for job, fire_at in warm:
+            if job.batch:
+                batches.setdefault((job.prewarm, fire_at), []).append(job)
+            else:
+                self._pool.submit(self._prewarm, [job], job.prewarm, job.args, fire_at)
+        for (func, fire_at), jobs in batches.items():
+            self._pool.submit(self._prewarm, jobs, func, [j.args for j in jobs], fire_at)
+
+    def _prewarm(self, jobs: List[Job], func: Callable, args: Any, fire_at: float):
+        try:
+            func(args, datetime.fromtimestamp(fire_at, jobs[0].tz))
+        except Exception as e:
+            print(f"[sched] {jobs[0].id}: prewarm failed (the fire will compute inline): {e}")
+
+    def _collect(self, now: float) -> List[tuple]:
+        # caller holds self._cond; pops everything due and reschedules it
+        due = []
+        solo: Dict[str, list] = {}   # non-batch job id -> its slots this round (several under "all")
+        while self._heap and self._heap[0][0] <= now:
+            _, _, job_id, gen, fire_at = heapq.heappop(self._heap)
+            job = self._jobs.get(job_id)
+            if job is None or job.gen != gen:
+                continue
+            if self.misfire_policy == "coalesce":
+                # every slot missed up to now collapses into the newest one, which is then judged for lateness
+                fire_at = max(fire_at, job.prev_before(now))
+            late = now - fire_at > self.misfire_grace
+            self._push(job, job.next_after(fire_at if self.misfire_policy == "all" or not late else now))
+            if job.last_fired is not None and fire_at <= job.last_fired:
+                continue  # already ran this slot (e.g. before a restart)
+            if late and self.misfire_policy != "all":
+                print(f"[sched] {job.id}: skipping run due {datetime.fromtimestamp(fire_at, job.tz).isoformat()} "
+                      f"(late by {now - fire_at:.0f}s)")
+                continue
+            if job.batch:
+                job.last_fired = fire_at
+                due.append(([job], job.func, None, [fire_at]))
+            elif job.id in solo:
+                job.last_fired = fire_at
+                solo[job.id].append(fire_at)
+            elif job.running:
+                print(f"[sched] {job.id}: previous run still going — skipping this slot")
+            else:
+                job.last_fired = fire_at
+                job.running = True
+                solo[job.id] = [fire_at]
+                due.append(([job], job.func, job.args, solo[job.id]))
+        return due
+
+    def _dispatch(self, due: List[tuple]):
+        batches: Dict[tuple, List[Job]] = {}
+        for jobs, func, args, fire_times in due:
+            if jobs[0].batch:
+                batches.setdefault((func, fire_times[0]), []).extend(jobs)
+            else:
+                self._pool.submit(self._run, jobs, func, args, fire_times)
+        for (func, fire_at), jobs in batches.items():
+            self._pool.submit(self._run, jobs, func, [j.args for j in jobs], [fire_at])
+
+    def _run(self, jobs: List[Job], func: Callable, args: Any, fire_times: List[float]):
+        # several fire times only when catching up missed slots under the "all" policy; run them in order
+        try:
+            for fire_at in fire_times:
+                try:
+                    func(args, datetime.fromtimestamp(fire_at, jobs[0].tz))
+                except Exception as e:
+                    print(f"[sched] {jobs[0].id}{f' (+{len(jobs) - 1} batched)' if len(jobs) > 1 else ''} failed: {e}")
+        finally:
+            for j in jobs:
+                j.running = False
+            if self.on_run:
+                try:
+                    self.on_run()
+                except Exception as e:
+                    print("[sched] on_run hook failed:", e)
@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict
+
+SNAPSHOT_VERSION = 1
+
+
+def load_snapshot(path: str) -> Dict[str, Any]:
+    """Return the saved state at `path`, or {} when missing/unreadable/from another version."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        print(f"[snapshot] ignoring unreadable snapshot {path}: {e}")
+        return {}
+    if not isinstance(data, dict) or data.get("version") != SNAPSHOT_VERSION:
+        return {}
+    return data.get("state") or {}
+
+
+def save_snapshot(path: str, state: Dict[str, Any]) -> bool:
+    """Atomically replace `path` with `state` (write to a temp file, then rename)."""
+    try:
+        d = os.path.dirname(path) or "."
+        os.makedirs(d, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".snapshot-", dir=d)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"version": SNAPSHOT_VERSION, "saved_at": time.time(), "state": state}, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        return True
+    except Exception as e:
+        print(f"[snapshot] save to {path} failed: {e}")
+        return False
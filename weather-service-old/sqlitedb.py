@@ -0,0 +1,29 @@
+import os
+import sqlite3
+
+# columns added after the first release, per table: (name, definition) for ALTER TABLE
+MIGRATIONS = {
+    "subscribers": (
+        ("detail", "TEXT NOT NULL DEFAULT 'brief'"),
+        ("alerts", "INTEGER NOT NULL DEFAULT 0"),
+    ),
+    "outbox": (
+        ("traceparent", "TEXT"),
+    ),
+}
+
+
+def connect(path: str, schema: str) -> sqlite3.Connection:
+    """Open `path` (WAL, rows as sqlite3.Row), create `schema` and add any MIGRATIONS column its tables lack."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False)
+    db.row_factory = sqlite3.Row
+    with db:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.executescript(schema)
+        for table, columns in MIGRATIONS.items():
+            have = {r["name"] for r in db.execute(f"PRAGMA table_info({table})")}
+            for col, definition in columns:
+                if have and col not in have:   # empty: the table isn't in this database
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {col} {definition}")
+    return db
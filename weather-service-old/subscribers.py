@@ -0,0 +1,112 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pytz
+from croniter import croniter
+
+from sqlitedb import connect
+
+FIELDS = ("name", "city", "state", "tz", "cron", "recipient", "detail", "enabled", "alerts")
+BOOL_FIELDS = ("enabled", "alerts")
+DETAIL_LEVELS = ("brief", "hourly", "week")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS subscribers (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    name        TEXT,
+    city        TEXT NOT NULL,
+    state       TEXT,
+    tz          TEXT NOT NULL,
+    cron        TEXT NOT NULL,
+    recipient   TEXT NOT NULL,
+    detail      TEXT NOT NULL DEFAULT 'brief',
+    enabled     INTEGER NOT NULL DEFAULT 1,
+    alerts      INTEGER NOT NULL DEFAULT 0,     -- also send forecast-change alerts (watch mode)
+    created_at  REAL NOT NULL,
+    updated_at  REAL NOT NULL
+)
+"""
+
+
+class SubscriberRegistry:
+    """SQLite-backed subscribers: who gets which city's forecast, when, in which timezone."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        """The connection, opened (and the schema migrated) on first use rather than at import."""
+        if self._conn is None:
+            with self._open_lock:
+                if self._conn is None:
+                    self._conn = connect(self.path, SCHEMA)
+        return self._conn
+
+    @staticmethod
+    def validate(sub: Dict) -> Dict:
+        if not (sub.get("city") or "").strip():
+            raise ValueError("city is required")
+        if not (sub.get("recipient") or "").strip():
+            raise ValueError("recipient is required")
+        if sub.get("tz") not in pytz.all_timezones_set:
+            raise ValueError(f"unknown timezone {sub.get('tz')!r}")
+        if not croniter.is_valid(sub.get("cron") or ""):
+            raise ValueError(f"invalid cron {sub.get('cron')!r}")
+        sub["detail"] = sub.get("detail") or "brief"
+        if sub["detail"] not in DETAIL_LEVELS:
+            raise ValueError(f"detail must be one of {DETAIL_LEVELS}")
+        return sub
+
+    def _row(self, row: Optional[sqlite3.Row]) -> Optional[Dict]:
+        if row is None:
+            return None
+        d = dict(row)
+        for k in BOOL_FIELDS:
+            d[k] = bool(d[k])
+        return d
+
+    def list(self, enabled_only: bool = False, alerts_only: bool = False) -> List[Dict]:
+        where = [c for c, on in (("enabled = 1", enabled_only), ("alerts = 1", alerts_only)) if on]
+        q = "SELECT * FROM subscribers" + (f" WHERE {' AND '.join(where)}" if where else "") + " ORDER BY id"
+        with self._lock:
+            return [self._row(r) for r in self._db.execute(q).fetchall()]
+
+    def get(self, sid: int) -> Optional[Dict]:
+        with self._lock:
+            return self._row(self._db.execute("SELECT * FROM subscribers WHERE id = ?", (sid,)).fetchone())
+
+    def create(self, sub: Dict) -> Dict:
+        sub = self.validate({k: sub.get(k) for k in FIELDS})
+        sub["enabled"] = sub["enabled"] is not False   # on unless explicitly disabled
+        sub["alerts"] = bool(sub["alerts"])
+        now = time.time()
+        with self._lock, self._db:
+            cur = self._db.execute(
+                f"INSERT INTO subscribers ({', '.join(FIELDS)}, created_at, updated_at) "
+                f"VALUES ({', '.join('?' for _ in FIELDS)}, ?, ?)",
+                [int(sub[k]) if k in BOOL_FIELDS else sub[k] for k in FIELDS] + [now, now],
+            )
+            sid = cur.lastrowid
+        return self.get(sid)
+
+    def update(self, sid: int, changes: Dict) -> Optional[Dict]:
+        cur = self.get(sid)
+        if cur is None:
+            return None
+        merged = self.validate({**cur, **{k: v for k, v in changes.items() if k in FIELDS}})
+        with self._lock, self._db:
+            self._db.execute(
+                f"UPDATE subscribers SET {', '.join(f'{k} = ?' for k in FIELDS)}, updated_at = ? WHERE id = ?",
+                [int(bool(merged[k])) if k in BOOL_FIELDS else merged[k] for k in FIELDS] + [time.time(), sid],
+            )
+        return self.get(sid)
+
+    def delete(self, sid: int) -> bool:
+        with self._lock, self._db:
+            return self._db.execute("DELETE FROM subscribers WHERE id = ?", (sid,)).rowcount > 0
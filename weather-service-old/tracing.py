@@ -0,0 +1,208 @@
+"""
+Minimal W3C trace-context tracing.
+
+span() times a block and records it as a child of the current span (a
+contextvar, so it follows asyncio tasks; use bind() for thread pools).
+inject() adds a `traceparent` header for the next hop, and span(parent=...)
+continues a trace received from one. Finished spans go to an in-memory ring
+for /debug/traces and, if configured, one JSON object per line to a file,
+written in batches by a background thread so a span never waits on disk.
+"""
+import atexit
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "end", "attrs", "status")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attrs: dict):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.status = "ok"
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def to_dict(self, service: str) -> dict:
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id,
+                "service": service, "name": self.name, "start": self.start,
+                "duration_ms": round(((self.end or time.time()) - self.start) * 1000, 2),
+                "status": self.status, "attrs": self.attrs}
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Exporter:
+    def __init__(self, service: str, path: Optional[str] = None, ring: int = 2000, max_bytes: int = 20_000_000,
+                 flush_interval: float = 1.0, max_pending: int = 10_000):
+        self.service = service
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending   # beyond this (disk stuck), new spans only reach the ring
+        self._ring: deque = deque(maxlen=ring)
+        self._pending: List[dict] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self.dropped = 0
+        self._dir_ready = False           # the directory is made on the first write, not at import
+        if path:
+            atexit.register(self.flush)
+
+    def export(self, span: Span):
+        rec = span.to_dict(self.service)
+        with self._lock:
+            self._ring.append(rec)
+            if not self.path:
+                return
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(rec)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name="trace-export", daemon=True)
+                self._writer.start()
+            if len(self._pending) >= 1000:
+                self._wake.set()
+
+    def _write_loop(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """Append every pending span to the file (the writer thread does this every flush_interval)."""
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        with self._write_lock:
+            if not self._dir_ready:
+                try:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    self._dir_ready = True
+                except OSError as e:
+                    # e.g. an unwritable DATA_DIR: keep serving, spans stay in the ring only
+                    print(f"[trace] export to {self.path} disabled: {e}")
+                    with self._lock:
+                        self.path = None
+                        self._pending = []
+                    return
+            try:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+                with open(self.path, "a") as f:
+                    f.write("".join(json.dumps(rec, default=str) + "\n" for rec in batch))
+            except OSError as e:
+                print(f"[trace] export of {len(batch)} span(s) to {self.path} failed: {e}")
+
+    def spans(self, trace_id: Optional[str] = None) -> List[dict]:
+        with self._lock:
+            return [s for s in self._ring if trace_id is None or s["trace_id"] == trace_id]
+
+
+_exporter = Exporter("app")
+
+
+def configure(service: str, path: Optional[str] = None, ring: int = 2000):
+    global _exporter
+    _exporter = Exporter(service, path, ring)
+
+
+def parse(traceparent: Optional[str]) -> Optional[Tuple[str, str]]:
+    """(trace_id, parent span id) from a traceparent header, or None if absent/invalid."""
+    m = TRACEPARENT.match((traceparent or "").strip().lower())
+    if not m or m.group(1) == "0" * 32 or m.group(2) == "0" * 16:
+        return None
+    return m.group(1), m.group(2)
+
+
+@contextmanager
+def span(name: str, parent: Optional[str] = None, **attrs) -> Iterator[Span]:
+    """
+    Time the block as a span. The parent is the current span, else `parent` (a
+    traceparent string, e.g. from a queued row or an inbound header), else a new trace.
+    """
+    cur = _current.get()
+    ctx = (cur.trace_id, cur.span_id) if cur is not None else parse(parent)
+    s = Span(name, ctx[0] if ctx else secrets.token_hex(16), ctx[1] if ctx else None, attrs)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.status = "error"
+        s.attrs["error"] = str(e)[:200]
+        raise
+    finally:
+        s.end = time.time()
+        _current.reset(token)
+        _exporter.export(s)
+
+
+def current_traceparent() -> Optional[str]:
+    cur = _current.get()
+    return cur.traceparent if cur is not None else None
+
+
+def inject(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    headers = dict(headers or {})
+    tp = current_traceparent()
+    if tp:
+        headers["traceparent"] = tp
+    return headers
+
+
+def bind(fn: Callable) -> Callable:
+    """Run `fn` in the caller's context, so spans opened in a pool thread join the caller's trace."""
+    ctx = copy_context()
+    return lambda *a, **kw: ctx.run(fn, *a, **kw)
+
+
+def traces(spans: List[dict], limit: int = 20) -> List[dict]:
+    """Group spans into traces (newest first), each with spans ordered by start and offset from the trace start."""
+    by_trace: Dict[str, List[dict]] = {}
+    for s in spans:
+        by_trace.setdefault(s["trace_id"], []).append(s)
+    out = []
+    for trace_id, group in by_trace.items():
+        group.sort(key=lambda s: s["start"])
+        t0 = group[0]["start"]
+        end = max(s["start"] + s["duration_ms"] / 1000 for s in group)
+        ids = {s["span_id"] for s in group}
+        out.append({
+            "trace_id": trace_id,
+            "root": next((s["name"] for s in group if s["parent_id"] not in ids), group[0]["name"]),
+            "start": t0,
+            "duration_ms": round((end - t0) * 1000, 2),
+            "spans": [dict(s, offset_ms=round((s["start"] - t0) * 1000, 2)) for s in group],
+        })
+    out.sort(key=lambda t: t["start"], reverse=True)
+    return out[:limit]
+
+
+def recent(trace_id: Optional[str] = None, limit: int = 20) -> List[dict]:
+    return traces(_exporter.spans(trace_id), limit)
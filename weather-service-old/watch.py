@@ -0,0 +1,163 @@
+import threading
+import time
+from typing import Dict, Hashable, List, Optional
+
+from snapshot import load_snapshot, save_snapshot
+
+THUNDER = (95, 96, 99)
+
+
+def severity(code: Optional[int]) -> int:
+    """Rough 0-9 badness of a WMO weather code, so "worse" can be a threshold."""
+    if code is None:
+        return 0
+    if code in THUNDER:
+        return 9 if code != 95 else 8
+    if code in (65, 67, 75, 82, 86):
+        return 7
+    if code in (63, 66, 73, 81, 77, 85):
+        return 6
+    if code in (61, 71, 80):
+        return 5
+    if 51 <= code <= 57:
+        return 4
+    if code in (45, 48):
+        return 3
+    if code in (2, 3):
+        return 1
+    return 0
+
+
+class Watcher:
+    """
+    Last-seen forecast per location, for change alerts.
+
+    observe() reduces a forecast to a compact snapshot (dates, WMO codes and
+    precipitation probabilities for the next `days` days). One identical to the
+    last one seen costs one tuple comparison; otherwise it is diffed against the
+    baseline, what subscribers were last told, and the per-day changes that
+    cross a threshold are returned:
+      worse    weather code severity up by >= severity_jump
+      thunder  a thunderstorm code (95/96/99) that wasn't forecast before
+      precip   precipitation probability up by >= precip_jump points
+    The first observation of a location is the baseline and never alerts. The
+    baseline moves only when an alert goes out, so a forecast that worsens in
+    small steps still alerts once the steps add up; days entering the forecast
+    range join it as first seen.
+    """
+
+    def __init__(self, path: str, days: int = 2, severity_jump: int = 2, precip_jump: float = 30):
+        self.path = path
+        self.days = days
+        self.severity_jump = severity_jump
+        self.precip_jump = precip_jump
+        self._lock = threading.Lock()
+        self._snaps: Dict[str, dict] = {}
+        self._dirty = False
+        self.counts = {"observed": 0, "unchanged": 0, "changed": 0, "alerts": 0}
+
+    @staticmethod
+    def key(loc: Hashable) -> str:
+        return "|".join(str(p) for p in loc) if isinstance(loc, tuple) else str(loc)
+
+    def snapshot(self, forecast: dict) -> dict:
+        daily = forecast.get("daily") or {}
+        n = self.days
+        return {
+            "time": list((daily.get("time") or [])[:n]),
+            "code": [None if c is None else int(c) for c in (daily.get("weathercode") or [])[:n]],
+            "precip": [None if p is None else float(p) for p in (daily.get("precipitation_probability_max") or [])[:n]],
+        }
+
+    def diff(self, old: dict, new: dict) -> List[dict]:
+        before = {day: i for i, day in enumerate(old["time"])}
+        changes = []
+        for i, day in enumerate(new["time"]):
+            j = before.get(day)
+            if j is None:
+                continue  # a day that just came into range has nothing to compare with
+            oc, nc = _at(old["code"], j), _at(new["code"], i)
+            if nc in THUNDER and oc not in THUNDER:
+                changes.append({"day": day, "kind": "thunder", "old": oc, "new": nc})
+            elif severity(nc) - severity(oc) >= self.severity_jump:
+                changes.append({"day": day, "kind": "worse", "old": oc, "new": nc})
+            op, np_ = _at(old["precip"], j), _at(new["precip"], i)
+            if op is not None and np_ is not None and np_ - op >= self.precip_jump:
+                changes.append({"day": day, "kind": "precip", "old": op, "new": np_})
+        return changes
+
+    @staticmethod
+    def rebase(base: dict, new: dict) -> dict:
+        """`base` over the days `new` covers; days it doesn't know yet are taken from `new`."""
+        known = {day: i for i, day in enumerate(base["time"])}
+        out = {"time": list(new["time"]), "code": [], "precip": []}
+        for i, day in enumerate(new["time"]):
+            j = known.get(day)
+            src, k = (new, i) if j is None else (base, j)
+            out["code"].append(_at(src["code"], k))
+            out["precip"].append(_at(src["precip"], k))
+        return out
+
+    def observe(self, loc: Hashable, forecast: dict) -> List[dict]:
+        key = self.key(loc)
+        new = self.snapshot(forecast)
+        with self._lock:
+            entry = self._snaps.get(key)
+            self.counts["observed"] += 1
+            if entry is not None and _same(entry["seen"], new):
+                self.counts["unchanged"] += 1
+                return []
+            self._dirty = True
+            if entry is None:
+                self._snaps[key] = {"seen": new, "base": new, "at": time.time()}
+                return []
+            self.counts["changed"] += 1
+            base = entry["base"]
+            changes = self.diff(base, new)
+            entry.update(seen=new, base=new if changes else self.rebase(base, new), at=time.time())
+            if changes:
+                self.counts["alerts"] += 1
+        return changes
+
+    def forget(self, keep: List[Hashable]):
+        """Drop snapshots of locations no longer watched."""
+        keep_keys = {self.key(k) for k in keep}
+        with self._lock:
+            for k in [k for k in self._snaps if k not in keep_keys]:
+                del self._snaps[k]
+                self._dirty = True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self.counts, locations=len(self._snaps))
+
+    def load(self):
+        if not self.path:
+            return
+        snaps = load_snapshot(self.path).get("locations") or {}
+        for k, v in snaps.items():
+            if "seen" not in v:   # saved before baselines were kept apart from the last forecast seen
+                snap = {f: v.get(f) or [] for f in ("time", "code", "precip")}
+                snaps[k] = {"seen": snap, "base": snap, "at": v.get("at")}
+        with self._lock:
+            self._snaps.update(snaps)
+        if snaps:
+            print(f"[watch] loaded {len(snaps)} location snapshot(s) from {self.path}")
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            snaps = dict(self._snaps)
+            self._dirty = False
+        save_snapshot(self.path, {"locations": snaps})
+
+
+def _at(values: list, i: int):
+    return values[i] if i < len(values) else None
+
+
+def _same(a: dict, b: dict) -> bool:
+    return (a["time"], a["code"], a["precip"]) == (b["time"], b["code"], b["precip"])